@@ -0,0 +1,169 @@
+"""
+Generates quizzes for a list of URLs and writes them to a JSONL file, one line per URL.
+
+    python -m backend.bulk urls.txt -o quizzes.jsonl --fetch-workers 16 --llm-workers 4
+    cat urls.txt | python -m backend.bulk - -o quizzes.jsonl
+
+URLs that already have a quiz in the output file are skipped, so an interrupted run can simply be restarted.
+Failed URLs are written with an "error" field and are tried again on the next run.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterable, List, Optional, Set, TextIO
+
+from .utils import fetch_documents, generate_quiz_from_documents, without_source_documents
+
+logger = logging.getLogger(__name__)
+
+
+def read_urls(lines: Iterable[str]) -> List[str]:
+    urls, seen = [], set()
+    for line in lines:
+        url = line.strip()
+        if url and not url.startswith("#") and url not in seen:
+            seen.add(url)
+            urls.append(url)
+    return urls
+
+
+def read_done_urls(path: str) -> Set[str]:
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # a line cut short by an interrupted run
+                continue
+            if "quiz" in record:
+                done.add(record["url"])
+    return done
+
+
+class BulkGenerator:
+    def __init__(self, output: TextIO, fetch_workers: int = 8, llm_workers: int = 4):
+        self.output = output
+        self.fetch_workers = fetch_workers
+        self.llm_workers = llm_workers
+
+        # fetching and generation are limited separately, but run in the same pool
+        # so that a URL goes to the LLM as soon as its page has been fetched
+        self._fetch_slots = threading.Semaphore(fetch_workers)
+        self._llm_slots = threading.Semaphore(llm_workers)
+        self._write_lock = threading.Lock()
+
+        self.succeeded = 0
+        self.failed = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.llm_seconds = 0.0
+
+    def process(self, url: str) -> None:
+        start = time.perf_counter()
+        try:
+            with self._fetch_slots:
+                documents = fetch_documents(url)
+            with self._llm_slots:
+                llm_start = time.perf_counter()
+                # one LLM call at a time per slot, so --llm-workers bounds the calls of long pages too
+                quiz, usage = generate_quiz_from_documents(url, documents, max_in_flight=1)
+                llm_seconds = time.perf_counter() - llm_start
+        except Exception as e:
+            logger.warning("Failed to generate a quiz for %s: %s", url, e)
+            self._write({"url": url, "error": f"{type(e).__name__}: {e}"}, failed=True)
+            return
+
+        with self._write_lock:
+            self.prompt_tokens += usage.get("prompt_tokens", 0)
+            self.completion_tokens += usage.get("completion_tokens", 0)
+            if usage:
+                self.llm_seconds += llm_seconds
+
+        self._write(
+            {
+                "url": url,
+                "quiz": without_source_documents(quiz),
+                "usage": usage,
+                "seconds": round(time.perf_counter() - start, 3),
+            }
+        )
+
+    def _write(self, record: Dict[str, Any], failed: bool = False) -> None:
+        line = json.dumps(record, ensure_ascii=False)
+        with self._write_lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+            if failed:
+                self.failed += 1
+            else:
+                self.succeeded += 1
+
+    def run(self, urls: List[str]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        max_workers = self.fetch_workers + self.llm_workers
+        pending = set()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for url in urls:
+                # submit lazily, so that thousands of URLs don't sit in the executor queue
+                if len(pending) >= 2 * max_workers:
+                    _, pending = wait(pending, return_when=FIRST_COMPLETED)
+                pending.add(executor.submit(self.process, url))
+            wait(pending)
+
+        return self.report(time.perf_counter() - start)
+
+    def report(self, seconds: float) -> Dict[str, Any]:
+        processed = self.succeeded + self.failed
+        return {
+            "urls": processed,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "seconds": round(seconds, 2),
+            "urls_per_minute": round(processed / seconds * 60, 2) if seconds else 0.0,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            # completion tokens per second of LLM time, and over the wall time of the whole run
+            "llm_tokens_per_second": round(self.completion_tokens / self.llm_seconds, 2) if self.llm_seconds else 0.0,
+            "tokens_per_second": round(self.completion_tokens / seconds, 2) if seconds else 0.0,
+        }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Generate quizzes for a list of URLs.")
+    parser.add_argument("input", help="file with one URL per line, or - to read from stdin")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file the quizzes are appended to")
+    parser.add_argument("--fetch-workers", type=int, default=8, help="maximum concurrent page fetches")
+    parser.add_argument("--llm-workers", type=int, default=4, help="maximum concurrent LLM calls")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+
+    if args.input == "-":
+        urls = read_urls(sys.stdin)
+    else:
+        with open(args.input, encoding="utf-8") as f:
+            urls = read_urls(f)
+
+    done = read_done_urls(args.output)
+    todo = [url for url in urls if url not in done]
+    logger.info("%d URLs, %d already done, %d to generate", len(urls), len(urls) - len(todo), len(todo))
+
+    with open(args.output, "a", encoding="utf-8") as output:
+        report = BulkGenerator(output, args.fetch_workers, args.llm_workers).run(todo)
+
+    print(json.dumps(report, indent=2), file=sys.stderr)
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
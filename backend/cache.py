@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+DEFAULT_CACHE_DIR = os.getenv("QUIZ_CACHE_DIR", ".quiz_cache")
+
+
+def hash_key(*parts: Any) -> str:
+    """Builds a stable content-addressed key from JSON-serializable parts."""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SQLiteCache:
+    """
+    A small disk-backed key/value cache for JSON-serializable values.
+
+    Entries expire after `ttl` seconds and, when the stored values exceed `max_bytes`,
+    the least recently used entries are evicted. Several caches can share one database file
+    by using different table names.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        path: Optional[str] = None,
+        ttl: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+    ):
+        self.name = name
+        self.path = path or os.path.join(DEFAULT_CACHE_DIR, "cache.sqlite3")
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                f"""CREATE TABLE IF NOT EXISTS {self.name} (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.name}_accessed_at ON {self.name} (accessed_at)"
+            )
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                f"SELECT value, created_at FROM {self.name} WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self._conn.execute(f"DELETE FROM {self.name} WHERE key = ?", (key,))
+                self.evictions += 1
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                f"UPDATE {self.name} SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any) -> None:
+        serialized = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.name} (key, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, serialized, len(serialized.encode("utf-8")), now, now),
+            )
+            self._evict(now)
+
+    def delete(self, key: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM {self.name} WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM {self.name}")
+
+    def _evict(self, now: float) -> None:
+        if self.ttl is not None:
+            cursor = self._conn.execute(
+                f"DELETE FROM {self.name} WHERE created_at < ?", (now - self.ttl,)
+            )
+            self.evictions += max(cursor.rowcount, 0)
+
+        if self.max_bytes is None:
+            return
+
+        total = self._conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.name}").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        # drop the least recently used entries until the cache fits again
+        for key, size in self._conn.execute(
+            f"SELECT key, size FROM {self.name} ORDER BY accessed_at ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute(f"DELETE FROM {self.name} WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = self._conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.name}"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "size_bytes": size,
+        }
@@ -0,0 +1,353 @@
+"""
+Records the replies of the upstream APIs (OpenAI chat completions and Serper searches) and replays them, so
+that evaluations can be re-run offline, reproducibly and without paying for the calls again.
+
+    QUIZ_CASSETTE=record    every call goes upstream and its reply is stored
+    QUIZ_CASSETTE=replay    every call is answered from the cassette; a missing reply raises CassetteMiss
+    QUIZ_CASSETTE=partial   stored replies are replayed, only new requests go upstream (and are stored)
+    QUIZ_CASSETTE=off       the default, the cassette is not used
+
+A request is identified by its fingerprint, a hash of everything sent upstream (model, messages, generation
+kwargs, or the search query and its parameters), so a changed prompt is a new request. The fingerprints a
+replay could not answer are appended to <path>.missing.jsonl, with their requests. A replay makes no network
+call to these APIs, so their keys (OPENAI_API_KEY, SERPERDEV_API_KEY) only have to be set, to any value.
+
+    python -m backend.cassette               # number of replies by kind and the size of the cassette, as JSON
+"""
+
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .cache import DEFAULT_CACHE_DIR, hash_key
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_MODES = ["off", "record", "replay", "partial"]
+
+# an index entry: the fingerprint, and the offset and length of the compressed reply in the data file
+_INDEX_ENTRY = struct.Struct("<16sQI4x")
+
+
+class CassetteMiss(LookupError):
+    """Raised in replay mode for a request that was not recorded."""
+
+
+class CassetteStore:
+    """
+    An append-only store of compressed replies by fingerprint, in two files:
+
+    - <path>.data: the zlib-compressed JSON replies, one after the other, read through a memory map
+    - <path>.index: fixed-size entries (fingerprint, offset, length), appended after their reply is written
+
+    The index is loaded into a dict when the store is opened; a later entry for the same fingerprint wins,
+    so recording again replaces a reply without rewriting the files. An index entry is only written once its
+    reply is on disk, so an interrupted recording loses at most the reply being written. One process
+    records at a time.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._data = open(f"{path}.data", "a+b")
+        self._index = open(f"{path}.index", "a+b")
+        self._map: Optional[mmap.mmap] = None
+        self._entries: Dict[bytes, tuple] = {}
+        self._load_index()
+
+    def _load_index(self) -> None:
+        data_size = os.fstat(self._data.fileno()).st_size
+        index_size = os.fstat(self._index.fileno()).st_size
+        if index_size < _INDEX_ENTRY.size:
+            return
+
+        with mmap.mmap(self._index.fileno(), 0, access=mmap.ACCESS_READ) as index:
+            # a trailing partial entry is the remainder of an interrupted write
+            for fingerprint, offset, length in _INDEX_ENTRY.iter_unpack(
+                index[: index_size - index_size % _INDEX_ENTRY.size]
+            ):
+                if offset + length <= data_size:
+                    self._entries[fingerprint] = (offset, length)
+
+    def __contains__(self, fingerprint: bytes) -> bool:
+        return fingerprint in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, fingerprint: bytes) -> Optional[Any]:
+        entry = self._entries.get(fingerprint)
+        if entry is None:
+            return None
+        offset, length = entry
+
+        with self._lock:
+            if self._map is None or offset + length > len(self._map):
+                # the data file grew since it was mapped
+                if self._map is not None:
+                    self._map.close()
+                self._map = mmap.mmap(self._data.fileno(), 0, access=mmap.ACCESS_READ)
+            payload = self._map[offset : offset + length]
+        return json.loads(zlib.decompress(payload))
+
+    def put(self, fingerprint: bytes, value: Any) -> None:
+        payload = zlib.compress(json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        with self._lock:
+            self._data.seek(0, os.SEEK_END)
+            offset = self._data.tell()
+            self._data.write(payload)
+            self._data.flush()
+            self._index.write(_INDEX_ENTRY.pack(fingerprint, offset, len(payload)))
+            self._index.flush()
+            self._entries[fingerprint] = (offset, len(payload))
+
+    def size_bytes(self) -> int:
+        return os.path.getsize(f"{self.path}.data") + os.path.getsize(f"{self.path}.index")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+            self._data.close()
+            self._index.close()
+
+
+def fingerprint(kind: str, request: Dict[str, Any]) -> bytes:
+    return bytes.fromhex(hash_key(kind, request))[:16]
+
+
+class Cassette:
+    """Answers upstream calls from a CassetteStore according to the mode, and keeps the report of misses."""
+
+    def __init__(self, path: str, mode: str = "replay"):
+        if mode not in CASSETTE_MODES or mode == "off":
+            raise ValueError(f"Invalid cassette mode {mode!r}, expected one of {CASSETTE_MODES[1:]}")
+        self.path = path
+        self.mode = mode
+        self.store = CassetteStore(path)
+
+        self.hits = 0
+        self.recorded = 0
+        self.missing: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, kind: str, request: Dict[str, Any]) -> Tuple[bytes, Optional[Any]]:
+        """
+        Returns the fingerprint of a request and its stored reply, or None when the request goes upstream.
+        Raises CassetteMiss in replay mode for a request that was not recorded.
+        """
+        key = fingerprint(kind, request)
+        if self.mode == "record":
+            return key, None
+
+        stored = self.store.get(key)
+        if stored is not None:
+            with self._lock:
+                self.hits += 1
+            metrics.increment("cassette_replays", kind=kind)
+            return key, stored["reply"]
+
+        if self.mode == "replay":
+            self._report_missing(kind, key, request)
+            raise CassetteMiss(f"No recorded {kind} reply for fingerprint {key.hex()}")
+        return key, None
+
+    def call(
+        self,
+        kind: str,
+        request: Dict[str, Any],
+        upstream: Callable[[], Any],
+        encode: Callable[[Any], Any],
+        decode: Callable[[Any], Any],
+    ) -> Any:
+        """
+        Returns the reply to `request`: `decode(stored reply)` when it is replayed, else the reply of
+        `upstream()`, stored as `encode(reply)`.
+        """
+        key, stored = self.lookup(kind, request)
+        if stored is not None:
+            return decode(stored)
+
+        reply = upstream()
+        self.record(kind, key, encode(reply))
+        return reply
+
+    def record(self, kind: str, key: bytes, encoded: Any) -> None:
+        self.store.put(key, {"kind": kind, "reply": encoded})
+        with self._lock:
+            self.recorded += 1
+        metrics.increment("cassette_records", kind=kind)
+
+    def _report_missing(self, kind: str, key: bytes, request: Dict[str, Any]) -> None:
+        with self._lock:
+            if key.hex() in self.missing:
+                return
+            self.missing[key.hex()] = kind
+            with open(f"{self.path}.missing.jsonl", "a", encoding="utf-8") as report:
+                report.write(
+                    json.dumps({"fingerprint": key.hex(), "kind": kind, "request": request}, ensure_ascii=False, default=str)
+                    + "\n"
+                )
+        logger.warning("Cassette has no %s reply for fingerprint %s", kind, key.hex())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "replies": len(self.store),
+                "hits": self.hits,
+                "recorded": self.recorded,
+                "missing": len(self.missing),
+                "missing_fingerprints": sorted(self.missing)[:20],
+            }
+
+
+@lru_cache(maxsize=None)
+def get_cassette() -> Optional[Cassette]:
+    """The process-wide cassette configured by QUIZ_CASSETTE and QUIZ_CASSETTE_PATH, or None when it is off."""
+    mode = os.getenv("QUIZ_CASSETTE", "off")
+    if mode == "off":
+        return None
+
+    cassette = Cassette(os.getenv("QUIZ_CASSETTE_PATH", os.path.join(DEFAULT_CACHE_DIR, "cassette")), mode)
+    metrics.register_collector("cassette", cassette.stats)
+    return cassette
+
+
+@lru_cache(maxsize=None)
+def _stream_class():
+    from openai import Stream
+
+    class ChunkStream(Stream):
+        """A Stream over chunks that are already at hand, for OpenAIGenerator, which checks for a Stream."""
+
+        def __init__(self, chunks: Iterable[Any]):
+            self._iterator = iter(chunks)
+
+    return ChunkStream
+
+
+class _CassetteCompletions:
+    def __init__(self, client: "CassetteOpenAI"):
+        self._client = client
+
+    def create(self, **kwargs: Any) -> Any:
+        return self._client.create_chat_completion(**kwargs)
+
+
+class _CassetteChat:
+    def __init__(self, client: "CassetteOpenAI"):
+        self.completions = _CassetteCompletions(client)
+
+
+class CassetteOpenAI:
+    """
+    Wraps the OpenAI client used by every OpenAIGenerator, above the rate limiter, so that replayed
+    completions neither wait for nor count against the rate limit. Streamed completions are stored as
+    their list of chunks and replayed as a stream.
+    """
+
+    def __init__(self, client: Any, cassette: Cassette):
+        self.client = client
+        self.cassette = cassette
+        self.chat = _CassetteChat(self)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.client, name)
+
+    def create_chat_completion(self, **kwargs: Any) -> Any:
+        from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+        if not kwargs.get("stream"):
+            return self.cassette.call(
+                "openai",
+                kwargs,
+                lambda: self.client.chat.completions.create(**kwargs),
+                lambda completion: completion.model_dump(mode="json"),
+                ChatCompletion.model_validate,
+            )
+
+        chunk_stream = _stream_class()
+        key, stored = self.cassette.lookup("openai", kwargs)
+        if stored is not None:
+            return chunk_stream(ChatCompletionChunk.model_validate(chunk) for chunk in stored)
+
+        def upstream() -> Iterator[Any]:
+            chunks = []
+            for chunk in self.client.chat.completions.create(**kwargs):
+                chunks.append(chunk.model_dump(mode="json"))
+                yield chunk
+            # stored once the stream is complete, so an interrupted stream is not recorded
+            self.cassette.record("openai", key, chunks)
+
+        return chunk_stream(upstream())
+
+
+class CassetteWebSearch:
+    """Wraps SerperDevWebSearch; the stored reply is the documents and links of the search."""
+
+    def __init__(self, websearch: Any, cassette: Cassette):
+        self.websearch = websearch
+        self.cassette = cassette
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.websearch, name)
+
+    def run(self, query: str) -> Dict[str, Any]:
+        from haystack import Document
+
+        request = {
+            "query": query,
+            "top_k": self.websearch.top_k,
+            "allowed_domains": getattr(self.websearch, "allowed_domains", None),
+            "search_params": getattr(self.websearch, "search_params", None),
+        }
+        return self.cassette.call(
+            "serper",
+            request,
+            lambda: self.websearch.run(query=query),
+            lambda result: {
+                "documents": [doc.to_dict(flatten=False) for doc in result["documents"]],
+                "links": result["links"],
+            },
+            lambda stored: {
+                "documents": [Document.from_dict(doc) for doc in stored["documents"]],
+                "links": stored["links"],
+            },
+        )
+
+
+def with_cassette(client: Any, wrapper: Callable[[Any, Cassette], Any]) -> Any:
+    """Wraps an upstream client with `wrapper` when the process-wide cassette is on."""
+    cassette = get_cassette()
+    return wrapper(client, cassette) if cassette is not None else client
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Number of replies by kind and size of a cassette.")
+    parser.add_argument("--path", help="cassette path, without extension (default: cassette in QUIZ_CACHE_DIR)")
+    args = parser.parse_args(argv)
+
+    store = CassetteStore(args.path or os.getenv("QUIZ_CASSETTE_PATH", os.path.join(DEFAULT_CACHE_DIR, "cassette")))
+    kinds: Dict[str, int] = {}
+    for key in list(store._entries):
+        kind = store.get(key)["kind"]
+        kinds[kind] = kinds.get(kind, 0) + 1
+    print(json.dumps({"replies": len(store), "by_kind": kinds, "size_bytes": store.size_bytes()}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional
+
+
+class _LeaderCancelled(Exception):
+    pass
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the function and
+    the callers that arrive while it is running wait for, and share, its result or exception.
+
+    If the first caller is interrupted rather than failing (KeyboardInterrupt, or the control flow exceptions
+    Streamlit raises to stop a script), the waiters don't inherit the interruption: one of them runs the
+    function again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, Future] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key: str, func: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        while True:
+            with self._lock:
+                self.calls += 1
+                future = self._in_flight.get(key)
+                leader = future is None
+                if leader:
+                    future = Future()
+                    self._in_flight[key] = future
+                else:
+                    self.coalesced += 1
+
+            if leader:
+                break
+            try:
+                # a waiter that gives up (timeout) does not affect the call in flight
+                return future.result(timeout=timeout)
+            except _LeaderCancelled:
+                with self._lock:
+                    self.calls -= 1
+                    self.coalesced -= 1
+                continue
+
+        try:
+            result = func()
+        except Exception as e:
+            self._finish(key)
+            future.set_exception(e)
+            raise
+        except BaseException:
+            self._finish(key)
+            future.set_exception(_LeaderCancelled())
+            raise
+        else:
+            self._finish(key)
+            future.set_result(result)
+            return result
+
+    def _finish(self, key: str) -> None:
+        # removed before the waiters are woken up, so a waiter that runs the function again starts a new call
+        with self._lock:
+            del self._in_flight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._in_flight)}
@@ -1,9 +1,27 @@
-from typing import Dict, List
+from typing import Any, Dict, List, Optional
 
-from haystack import component
+from haystack import Document, component
+from haystack.dataclasses import ByteStream
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .cache import SQLiteCache, hash_key
+from .concurrency import SingleFlight
+from .quiz_schema import validate_question
+from .tokenization import count_tokens
+
+from collections import Counter
+from urllib.parse import unquote, urlparse
 
 import json
 import json_repair
+import logging
+import math
+import re
+import requests
+import unicodedata
+
+logger = logging.getLogger(__name__)
 
 @component
 class QuizParser:
@@ -11,6 +29,22 @@ class QuizParser:
     def run(self, replies: List[str]):
         reply = replies[0]
 
+        try:
+            # with structured output the reply is exactly the JSON document
+            quiz = json.loads(reply)
+        except json.JSONDecodeError:
+            quiz = self._extract_json(reply)
+
+        # sometimes the JSON contains a list instead of a dictionary
+        if isinstance(quiz, list):
+            quiz = quiz[0]
+
+        logger.debug("Parsed quiz: %s", quiz)
+
+        return {"quiz": quiz}
+
+    @staticmethod
+    def _extract_json(reply: str):
         # even if prompted to respond with JSON only, sometimes the model returns a mix of JSON and text
         first_index = min(reply.find("{"), reply.find("["))
         last_index = max(reply.rfind("}"), reply.rfind("]")) + 1
@@ -18,15 +52,496 @@ class QuizParser:
         json_portion = reply[first_index:last_index]
 
         try:
-            quiz = json.loads(json_portion)
+            return json.loads(json_portion)
         except json.JSONDecodeError:
             # if the JSON is not well-formed, try to repair it
-            quiz = json_repair.loads(json_portion)
+            return json_repair.loads(json_portion)
 
-        # sometimes the JSON contains a list instead of a dictionary
-        if isinstance(quiz, list):
-            quiz = quiz[0]
 
-        print(quiz)
+@component
+class QuizValidator:
+    """
+    Validates every question of a parsed quiz against QUESTION_SCHEMA.
 
-        return {"quiz": quiz}
+    Invalid questions don't fail the quiz: their indices are returned, so that only they are generated again.
+    A reply without a list of questions (or without a topic, if `require_topic`) can't be fixed that way and
+    raises a ValueError.
+    """
+
+    def __init__(self, require_topic: bool = True):
+        self.require_topic = require_topic
+
+    @component.output_types(quiz=Dict, invalid_questions=List[int])
+    def run(self, quiz: Dict):
+        if not isinstance(quiz, dict) or not isinstance(quiz.get("questions"), list):
+            raise ValueError(f"The reply is not a quiz: {str(quiz)[:200]!r}")
+        if self.require_topic and not (isinstance(quiz.get("topic"), str) and quiz["topic"].strip()):
+            raise ValueError("The quiz has no topic")
+
+        invalid_questions = []
+        for i, question in enumerate(quiz["questions"]):
+            errors = validate_question(question, f"questions[{i}]")
+            if errors:
+                logger.info("Invalid question %d: %s", i, "; ".join(errors))
+                invalid_questions.append(i)
+
+        return {"quiz": quiz, "invalid_questions": invalid_questions}
+
+
+class IncrementalQuizParser:
+    """
+    Parses a quiz JSON while it is being streamed, returning every question object as soon as it is complete.
+
+    Question objects are recognized as objects directly inside an array that have a "question" key, so both
+    the expected {"topic": ..., "questions": [...]} layout and a list wrapping it are supported.
+    The final quiz is still produced by QuizParser on the complete reply.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._position = 0
+        self._in_string = False
+        self._escaped = False
+        # one entry per open container: its opening character and start index in the buffer
+        self._stack = []
+
+    def feed(self, text: str) -> List[Dict]:
+        self.buffer += text
+        questions = []
+
+        while self._position < len(self.buffer):
+            char = self.buffer[self._position]
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"' and self._stack:
+                self._in_string = True
+            elif char in "{[":
+                self._stack.append((char, self._position))
+            elif char in "}]" and self._stack:
+                opening, start = self._stack.pop()
+                parent_is_array = bool(self._stack) and self._stack[-1][0] == "["
+                if opening == "{" and char == "}" and parent_is_array:
+                    question = self._parse_object(self.buffer[start : self._position + 1])
+                    if question is not None:
+                        questions.append(question)
+
+            self._position += 1
+
+        return questions
+
+    @staticmethod
+    def _parse_object(text: str) -> Optional[Dict]:
+        try:
+            obj = json.loads(text)
+        except json.JSONDecodeError:
+            obj = json_repair.loads(text)
+        if isinstance(obj, dict) and "question" in obj:
+            return obj
+        return None
+
+
+# a list of option letters, optionally quoted and in brackets, separated by commas or spaces: "a, c, b", "[a c b]"
+ANSWER_LETTERS_PATTERN = re.compile(r"\s*\[?\s*['\"]?[a-dA-D]['\"]?(?:\s*[,;\s]\s*['\"]?[a-dA-D]['\"]?)*\s*\]?\s*\.?\s*")
+
+
+@component
+class AnswerListParser:
+    @component.output_types(answers=List[Optional[str]])
+    def run(self, replies: List[str]):
+        reply = replies[0]
+
+        first_index = reply.find("[")
+        last_index = reply.rfind("]") + 1
+
+        list_portion = reply[first_index:last_index] if 0 <= first_index < last_index else reply
+
+        try:
+            answers = json.loads(list_portion)
+        except json.JSONDecodeError:
+            # if the list is not well-formed (e.g. "a, c, b" without brackets or quotes), take the bare letters,
+            # but only from a reply made of nothing else: in a sentence ("A resposta é a c") the articles match
+            # too, and answers aligned by position would score the wrong letters instead of asking again
+            answers = (
+                re.findall(r"[a-dA-D]", list_portion) if ANSWER_LETTERS_PATTERN.fullmatch(list_portion) else []
+            )
+
+        if not isinstance(answers, list):
+            answers = []
+
+        # entries that are not a valid option are left as None, so that they can be asked again one by one
+        answers = [self._normalize(answer) for answer in answers]
+
+        return {"answers": answers}
+
+    @staticmethod
+    def _normalize(answer) -> Optional[str]:
+        if not isinstance(answer, str):
+            return None
+        answer = answer.strip().lower().rstrip(".")
+        return answer if answer in ["a", "b", "c", "d"] else None
+
+
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize_words(text: str) -> List[str]:
+    return WORD_PATTERN.findall(text.lower())
+
+
+def split_passages(text: str, passage_words: int = 120, min_line_words: int = 4) -> List[str]:
+    """Drops boilerplate lines and groups the remaining lines into passages of about `passage_words` words."""
+    lines = [line.strip() for line in text.splitlines()]
+    repeated = {line for line, count in Counter(lines).items() if count > 1}
+
+    passages, current, current_words = [], [], 0
+    for line in lines:
+        words = len(line.split())
+        # short lines without sentence punctuation are menus, link lists, captions or headings
+        if not line or line in repeated or (words < min_line_words and not line.endswith((".", "?", "!", ":"))):
+            continue
+        current.append(line)
+        current_words += words
+        if current_words >= passage_words:
+            passages.append("\n".join(current))
+            current, current_words = [], 0
+    if current:
+        passages.append("\n".join(current))
+    return passages
+
+
+def split_words(text: str, passage_words: int = 120) -> List[str]:
+    """Groups the words of a text into passages of `passage_words` words, without dropping anything."""
+    words = text.split()
+    return [" ".join(words[i : i + passage_words]) for i in range(0, len(words), passage_words)]
+
+
+@component
+class PassageSelector:
+    """
+    Replaces each document by its most relevant passages, packed into a token budget.
+
+    Boilerplate lines (menus, link lists, repeated lines) are dropped, the remaining lines are grouped
+    into passages, and passages are ranked with BM25 against the page title (taken from the URL)
+    and the opening passage. The first passage is always kept and the selected passages keep their
+    original order.
+    """
+
+    def __init__(self, token_budget: int = 1000, passage_words: int = 120, min_line_words: int = 4):
+        self.token_budget = token_budget
+        self.passage_words = passage_words
+        self.min_line_words = min_line_words
+
+    @component.output_types(documents=List[Document])
+    def run(self, documents: List[Document]):
+        selected = []
+        for document in documents:
+            # a page made only of short lines (lists, tables) has no passage left, its raw text is used instead
+            passages = self._split_passages(document.content or "") or split_words(
+                document.content or "", self.passage_words
+            )
+            if not passages:
+                continue
+            content = "\n\n".join(self._select(passages, self._title_terms(document)))
+            selected.append(Document(content=content, meta=document.meta))
+        return {"documents": selected}
+
+    def _split_passages(self, text: str) -> List[str]:
+        return split_passages(text, self.passage_words, self.min_line_words)
+
+    @staticmethod
+    def _title_terms(document: Document) -> List[str]:
+        url = document.meta.get("url") or ""
+        path = unquote(urlparse(url).path)
+        return tokenize_words(path.replace("_", " ").replace("-", " "))
+
+    def _select(self, passages: List[str], title_terms: List[str]) -> List[str]:
+        tokenized = [tokenize_words(passage) for passage in passages]
+        query = set(title_terms) | set(tokenized[0])
+        scores = self._bm25(tokenized, query)
+
+        chosen, used = [], 0
+        # the opening passage usually summarizes the page, so it is always sent
+        ranking = [0] + sorted(range(1, len(passages)), key=lambda i: scores[i], reverse=True)
+        for i in ranking:
+            tokens = count_tokens(passages[i])
+            if used + tokens > self.token_budget:
+                if chosen:
+                    continue
+                # a single passage larger than the budget is cut, like the old truncate()
+                passages[i] = passages[i][: self.token_budget * 4]
+                tokens = count_tokens(passages[i])
+            chosen.append(i)
+            used += tokens
+
+        return [passages[i] for i in sorted(chosen)]
+
+    @staticmethod
+    def _bm25(tokenized: List[List[str]], query: set, k1: float = 1.5, b: float = 0.75) -> List[float]:
+        average_length = sum(len(tokens) for tokens in tokenized) / len(tokenized) or 1
+        document_frequency = Counter(term for tokens in tokenized for term in set(tokens) if term in query)
+
+        scores = []
+        for tokens in tokenized:
+            frequencies = Counter(tokens)
+            score = 0.0
+            for term, df in document_frequency.items():
+                tf = frequencies.get(term, 0)
+                if not tf:
+                    continue
+                idf = math.log(1 + (len(tokenized) - df + 0.5) / (df + 0.5))
+                score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(tokens) / average_length))
+            scores.append(score)
+        return scores
+
+
+@component
+class SectionSplitter:
+    """
+    Splits long documents into at most `max_sections` consecutive sections of similar size, each cut to
+    `section_tokens`, so that every part of the page gets its own quiz generation prompt.
+    """
+
+    def __init__(self, section_tokens: int = 800, max_sections: int = 8, passage_words: int = 120):
+        self.section_tokens = section_tokens
+        self.max_sections = max_sections
+        self.passage_words = passage_words
+
+    @component.output_types(sections=List[Document])
+    def run(self, documents: List[Document]):
+        passages = [
+            (passage, document.meta)
+            for document in documents
+            for passage in split_passages(document.content or "", self.passage_words)
+            or split_words(document.content or "", self.passage_words)
+        ]
+        if not passages:
+            return {"sections": []}
+
+        tokens = [count_tokens(passage) for passage, _ in passages]
+        count = max(1, min(self.max_sections, math.ceil(sum(tokens) / self.section_tokens)))
+        target = sum(tokens) / count
+
+        sections, current, current_tokens = [], [], 0
+        for (passage, meta), passage_tokens in zip(passages, tokens):
+            if current and current_tokens + passage_tokens > target and len(sections) < count - 1:
+                sections.append(self._section(current, len(sections)))
+                current, current_tokens = [], 0
+            current.append((passage, meta, passage_tokens))
+            current_tokens += passage_tokens
+        sections.append(self._section(current, len(sections)))
+
+        return {"sections": sections}
+
+    def _section(self, passages: List, index: int) -> Document:
+        # with more text than max_sections * section_tokens, each section keeps its opening passages
+        kept, used = [], 0
+        for passage, _, passage_tokens in passages:
+            if kept and used + passage_tokens > self.section_tokens:
+                break
+            kept.append(passage[: self.section_tokens * 4])
+            used += passage_tokens
+        return Document(content="\n\n".join(kept), meta={**passages[0][1], "section": index})
+
+
+@component
+class QuestionSelector:
+    """
+    Picks `count` questions out of the candidates generated for the sections of a document, without an LLM call.
+
+    Questions are chosen greedily to cover as many sections as possible, then to be as different as
+    possible from the questions already chosen (word overlap of the question and its right answer), then to
+    spread the difficulties. The result is ordered from the easiest to the hardest question.
+    """
+
+    def __init__(self, count: int = 5):
+        self.count = count
+
+    @component.output_types(questions=List[Dict])
+    def run(self, candidates: List[Dict]):
+        words = [self._words(candidate) for candidate in candidates]
+        remaining = list(range(len(candidates)))
+        chosen: List[int] = []
+        sections: Counter = Counter()
+        difficulties: Counter = Counter()
+
+        while remaining and len(chosen) < self.count:
+
+            def cost(i):
+                similarity = max((self._jaccard(words[i], words[j]) for j in chosen), default=0.0)
+                candidate = candidates[i]
+                return sections[candidate["section"]], round(similarity, 1), difficulties[candidate["difficulty"]]
+
+            best = min(remaining, key=cost)
+            remaining.remove(best)
+            chosen.append(best)
+            sections[candidates[best]["section"]] += 1
+            difficulties[candidates[best]["difficulty"]] += 1
+
+        chosen.sort(key=lambda i: (candidates[i]["difficulty"], candidates[i]["section"]))
+        return {"questions": [candidates[i]["question"] for i in chosen]}
+
+    @staticmethod
+    def _words(candidate: Dict) -> set:
+        question = candidate["question"]
+        right_option = question["options"][ord(question["right_option"]) - ord("a")]
+        return set(tokenize_words(question["question"] + " " + right_option))
+
+    @staticmethod
+    def _jaccard(a: set, b: set) -> float:
+        return len(a & b) / len(a | b) if a or b else 0.0
+
+
+@component
+class CachedDocumentFetcher:
+    """
+    Fetches URLs and converts them to Documents, like LinkContentFetcher followed by HTMLToDocument.
+
+    Response bodies and their converted Documents are kept in a disk cache and revalidated with
+    ETag / If-Modified-Since, so an unchanged page costs a 304 and no conversion.
+    Connections are kept alive and pooled per host.
+    """
+
+    def __init__(
+        self,
+        cache: Optional[SQLiteCache] = None,
+        timeout: float = 10,
+        retry_attempts: int = 2,
+        pool_maxsize: int = 10,
+    ):
+        self.cache = cache or SQLiteCache("fetches", max_bytes=200 * 1024 * 1024)
+        self.timeout = timeout
+
+        from haystack.components.converters import HTMLToDocument
+
+        self.converter = HTMLToDocument()
+
+        retries = Retry(
+            total=retry_attempts,
+            backoff_factor=1,
+            status_forcelist=[429, 500, 502, 503, 504],
+            respect_retry_after_header=True,
+        )
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=pool_maxsize, max_retries=retries)
+
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(
+            {
+                "accept": "*/*",
+                "User-Agent": "quiz/CachedDocumentFetcher",
+                "Accept-Language": "en-US,en;q=0.9,pt;q=0.8",
+                "referer": "https://www.google.com/",
+            }
+        )
+
+        self.not_modified = 0
+        self.fetched = 0
+
+    @component.output_types(documents=List[Document])
+    def run(self, urls: List[str]):
+        documents = []
+        for url in urls:
+            documents.extend(self._fetch_documents(url))
+        return {"documents": documents}
+
+    def _fetch_documents(self, url: str) -> List[Document]:
+        key = hash_key(url)
+        entry = self.cache.get(key)
+
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+
+        if response.status_code == 304 and entry is not None:
+            self.not_modified += 1
+            logger.debug("%s not modified, reusing the converted documents", url)
+            return [Document.from_dict(doc) for doc in entry["documents"]]
+
+        response.raise_for_status()
+        self.fetched += 1
+
+        content_type = response.headers.get("Content-Type", "text/html").split(";")[0].strip()
+        stream = ByteStream.from_string(response.text)
+        stream.meta.update({"content_type": content_type, "url": url})
+        documents = self.converter.run(sources=[stream])["documents"]
+
+        if response.headers.get("ETag") or response.headers.get("Last-Modified"):
+            self.cache.set(
+                key,
+                {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "documents": [doc.to_dict(flatten=False) for doc in documents],
+                },
+            )
+        elif entry is not None:
+            self.cache.delete(key)
+
+        return documents
+
+    def stats(self) -> Dict[str, Any]:
+        return {"fetched": self.fetched, "not_modified": self.not_modified, **self.cache.stats()}
+
+
+def normalize_query(query: str) -> str:
+    # case, accents, punctuation and spacing differences do not change the search results
+    query = unicodedata.normalize("NFKD", query.casefold())
+    query = "".join(char for char in query if not unicodedata.combining(char))
+    return " ".join(tokenize_words(query))
+
+
+@component
+class CachedWebSearch:
+    """
+    SerperDevWebSearch behind a persistent cache keyed by the normalized query.
+
+    Concurrent searches for the same query share one request to the search API.
+    """
+
+    def __init__(self, top_k: int = 3, cache: Optional[SQLiteCache] = None):
+        from haystack.components.websearch.serper_dev import SerperDevWebSearch
+
+        from .cassette import CassetteWebSearch, with_cassette
+
+        self.top_k = top_k
+        self.websearch = with_cassette(SerperDevWebSearch(top_k=top_k), CassetteWebSearch)
+        self.cache = cache or SQLiteCache("searches", ttl=24 * 3600, max_bytes=50 * 1024 * 1024)
+        self.single_flight = SingleFlight()
+
+    @component.output_types(documents=List[Document], links=List[str])
+    def run(self, query: str):
+        key = hash_key(normalize_query(query), self.top_k)
+
+        cached = self.cache.get(key)
+        if cached is None:
+            cached = self.single_flight.do(key, lambda: self._search(key, query))
+
+        return {
+            "documents": [Document.from_dict(doc) for doc in cached["documents"]],
+            "links": cached["links"],
+        }
+
+    def _search(self, key: str, query: str) -> Dict[str, Any]:
+        result = self.websearch.run(query=query)
+        cached = {
+            "documents": [doc.to_dict(flatten=False) for doc in result["documents"]],
+            "links": result["links"],
+        }
+        self.cache.set(key, cached)
+        return cached
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.single_flight.stats()
+        return {**self.cache.stats(), "coalesced": stats["coalesced"], "in_flight": stats["in_flight"]}
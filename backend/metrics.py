@@ -0,0 +1,257 @@
+import contextlib
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class RollingHistogram:
+    """Keeps the last `window` observations for percentiles, plus the all-time count and sum."""
+
+    def __init__(self, window: int = 1000):
+        self.values = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.values.append(value)
+        self.count += 1
+        self.total += value
+
+    def summary(self) -> Dict[str, float]:
+        values = sorted(self.values)
+        if not values:
+            return {"count": self.count, "sum": self.total}
+
+        def quantile(q: float) -> float:
+            return values[min(int(q * len(values)), len(values) - 1)]
+
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "mean": sum(values) / len(values),
+            "p50": quantile(0.5),
+            "p95": quantile(0.95),
+            "p99": quantile(0.99),
+            "max": values[-1],
+        }
+
+
+class MetricsRegistry:
+    """
+    Process-wide counters and rolling histograms, labeled like Prometheus metrics.
+
+    Components that already keep their own statistics (caches, fetchers) register a collector,
+    a callable returning a dict of numbers, which is read when the metrics are exported.
+    """
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._histograms: Dict[str, Dict[LabelKey, RollingHistogram]] = {}
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._collectors: Dict[str, Callable[[], Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            histograms = self._histograms.setdefault(name, {})
+            if key not in histograms:
+                histograms[key] = RollingHistogram(self.window)
+            histograms[key].observe(value)
+
+    def increment(self, name: str, value: float = 1, **labels: Any) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            counters = self._counters.setdefault(name, {})
+            counters[key] = counters.get(key, 0) + value
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels: Any) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def register_collector(self, name: str, collector: Callable[[], Dict[str, Any]]) -> None:
+        self._collectors[name] = collector
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            histograms = {
+                name: [{"labels": dict(key), **histogram.summary()} for key, histogram in series.items()]
+                for name, series in self._histograms.items()
+            }
+            counters = {
+                name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                for name, series in self._counters.items()
+            }
+        collectors = {name: collector() for name, collector in list(self._collectors.items())}
+        return {"histograms": histograms, "counters": counters, "collectors": collectors}
+
+    def to_prometheus(self, prefix: str = "quiz") -> str:
+        snapshot = self.snapshot()
+        lines = []
+
+        def labels_text(labels: Dict[str, str], **extra: str) -> str:
+            labels = {**labels, **extra}
+            if not labels:
+                return ""
+            return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+        for name, series in snapshot["histograms"].items():
+            lines.append(f"# TYPE {prefix}_{name} summary")
+            for entry in series:
+                for quantile in ("p50", "p95", "p99"):
+                    if quantile in entry:
+                        q = str(int(quantile[1:]) / 100)
+                        lines.append(f"{prefix}_{name}{labels_text(entry['labels'], quantile=q)} {entry[quantile]}")
+                lines.append(f"{prefix}_{name}_sum{labels_text(entry['labels'])} {entry['sum']}")
+                lines.append(f"{prefix}_{name}_count{labels_text(entry['labels'])} {entry['count']}")
+
+        for name, series in snapshot["counters"].items():
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            for entry in series:
+                lines.append(f"{prefix}_{name}_total{labels_text(entry['labels'])} {entry['value']}")
+
+        for name, values in snapshot["collectors"].items():
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"# TYPE {prefix}_{name}_{key} gauge")
+                    lines.append(f"{prefix}_{name}_{key} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = MetricsRegistry()
+
+
+def payload_size(value: Any) -> int:
+    """A cheap estimate of the size of component inputs and outputs, in characters (or bytes for binary data)."""
+    if value is None:
+        return 0
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(payload_size(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(payload_size(item) for item in value)
+    # Documents and ByteStreams
+    if hasattr(value, "content"):
+        return payload_size(value.content)
+    if hasattr(value, "data"):
+        return payload_size(value.data)
+    return 0
+
+
+# the name of the pipeline currently running in this thread, used to label component metrics
+_current_pipeline = threading.local()
+
+
+def run_pipeline(name: str, pipeline: Any, data: Dict[str, Any], **kwargs: Any) -> Dict[str, Any]:
+    """Runs a Haystack pipeline, recording its wall time and the time, payload sizes and tokens of every component."""
+    install_tracer()
+
+    previous = getattr(_current_pipeline, "name", None)
+    _current_pipeline.name = name
+    try:
+        with metrics.timer("pipeline_seconds", pipeline=name):
+            return pipeline.run(data, **kwargs)
+    except Exception:
+        metrics.increment("pipeline_errors", pipeline=name)
+        raise
+    finally:
+        _current_pipeline.name = previous
+
+
+_tracer_installed = False
+_tracer_lock = threading.Lock()
+
+
+def install_tracer() -> None:
+    global _tracer_installed
+    with _tracer_lock:
+        if not _tracer_installed:
+            _enable_metrics_tracer()
+            _tracer_installed = True
+
+
+def _enable_metrics_tracer() -> None:
+    from haystack import tracing
+
+    class ComponentSpan(tracing.Span):
+        def __init__(self, operation_name: str, tags: Dict[str, Any]):
+            self.operation_name = operation_name
+            self.tags = dict(tags)
+
+        def set_tag(self, key: str, value: Any) -> None:
+            self.tags[key] = value
+
+        def set_content_tag(self, key: str, value: Any) -> None:
+            # only the sizes are kept, so this does not depend on HAYSTACK_CONTENT_TRACING_ENABLED
+            if self.operation_name != "haystack.component.run":
+                return
+            labels = _component_labels(self.tags)
+            if key == "haystack.component.input":
+                metrics.observe("component_input_size", payload_size(value), **labels)
+            elif key == "haystack.component.output":
+                metrics.observe("component_output_size", payload_size(value), **labels)
+                _observe_usage(value, labels)
+
+    class MetricsTracer(tracing.Tracer):
+        def __init__(self):
+            self._spans = threading.local()
+
+        @contextlib.contextmanager
+        def trace(self, operation_name: str, tags: Optional[Dict[str, Any]] = None) -> Iterator[tracing.Span]:
+            span = ComponentSpan(operation_name, tags or {})
+            stack = self._spans.__dict__.setdefault("stack", [])
+            stack.append(span)
+            start = time.perf_counter()
+            try:
+                yield span
+            finally:
+                stack.pop()
+                if operation_name == "haystack.component.run":
+                    metrics.observe("component_seconds", time.perf_counter() - start, **_component_labels(span.tags))
+
+        def current_span(self) -> Optional[tracing.Span]:
+            stack = getattr(self._spans, "stack", None)
+            return stack[-1] if stack else None
+
+    tracing.enable_tracing(MetricsTracer())
+
+
+def _component_labels(tags: Dict[str, Any]) -> Dict[str, str]:
+    return {
+        "pipeline": getattr(_current_pipeline, "name", None) or "unknown",
+        "component": tags.get("haystack.component.name", "unknown"),
+    }
+
+
+def _observe_usage(output: Any, labels: Dict[str, str]) -> None:
+    if not isinstance(output, dict):
+        return
+    for meta in output.get("meta") or []:
+        usage = meta.get("usage") if isinstance(meta, dict) else None
+        if not usage:
+            continue
+        for key in ("prompt_tokens", "completion_tokens"):
+            if usage.get(key) is not None:
+                metrics.observe(key, usage[key], pipeline=labels["pipeline"])
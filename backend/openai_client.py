@@ -0,0 +1,226 @@
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from .metrics import metrics
+from .tokenization import count_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    A bucket refilled continuously at `per_minute / 60` units per second.
+
+    Callers reserve units up front and sleep for the returned time, so concurrent callers queue
+    in arrival order instead of polling.
+    """
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.rate = per_minute / 60
+        self.available = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.available = min(self.per_minute, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        self._refill(now)
+        # a single request larger than the whole budget only has to wait for a full bucket
+        self.available -= min(amount, self.per_minute)
+        return max(0.0, -self.available / self.rate)
+
+    def refund(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.available = min(self.per_minute, self.available + amount)
+
+
+class RateLimiter:
+    """
+    Keeps requests within both a requests/minute and a tokens/minute budget.
+
+    The request rate adapts: every 429 halves it (down to a tenth of the configured rate) and pauses
+    all callers for the server's Retry-After, and every success brings it back up by 2%. Callers waiting
+    for a pause add up to `pause_jitter` seconds each, so they don't all retry at the same instant.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float, pause_jitter: float = 1.0):
+        self.max_requests_per_minute = requests_per_minute
+        self.pause_jitter = pause_jitter
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.paused_until = 0.0
+        self.waiting = 0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, estimated_tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            pause = self.paused_until - now
+            if pause > 0:
+                pause += random.uniform(0, self.pause_jitter)
+            wait = max(
+                self.requests.reserve(1, now),
+                self.tokens.reserve(estimated_tokens, now),
+                pause,
+            )
+            if wait > 0:
+                self.waiting += 1
+
+        if wait > 0:
+            try:
+                time.sleep(wait)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+
+        metrics.observe("openai_wait_seconds", wait)
+        return wait
+
+    def settle(self, estimated_tokens: int, used_tokens: int, succeeded: bool = True) -> None:
+        with self._lock:
+            now = time.monotonic()
+            # return what the estimate over-reserved (or take what it missed)
+            self.tokens.refund(estimated_tokens - used_tokens, now)
+            if succeeded:
+                self._set_request_rate(self.requests.per_minute * 1.02)
+
+    def throttle(self, retry_after: Optional[float]) -> None:
+        with self._lock:
+            self.rate_limited += 1
+            self._set_request_rate(self.requests.per_minute / 2)
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+    def _set_request_rate(self, per_minute: float) -> None:
+        per_minute = min(max(per_minute, self.max_requests_per_minute / 10), self.max_requests_per_minute)
+        self.requests.per_minute = per_minute
+        self.requests.rate = per_minute / 60
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "queue_depth": self.waiting,
+                "requests_per_minute": round(self.requests.per_minute, 1),
+                "rate_limited": self.rate_limited,
+                "paused_seconds": round(max(0.0, self.paused_until - time.monotonic()), 2),
+            }
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        # Retry-After can also be an HTTP date, in that case use the backoff
+        pass
+    return None
+
+
+class _RateLimitedCompletions:
+    def __init__(self, client: "RateLimitedOpenAI"):
+        self._client = client
+
+    def create(self, **kwargs: Any) -> Any:
+        return self._client.create_chat_completion(**kwargs)
+
+
+class _RateLimitedChat:
+    def __init__(self, client: "RateLimitedOpenAI"):
+        self.completions = _RateLimitedCompletions(client)
+
+
+class RateLimitedOpenAI:
+    """
+    Wraps an OpenAI client, shared by every OpenAIGenerator of the process, so that all pipelines go through
+    one connection pool, one rate limiter and the same retry policy.
+
+    Only `chat.completions.create`, the call made by OpenAIGenerator, is rate limited.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        requests_per_minute: float = 500,
+        tokens_per_minute: float = 200_000,
+        max_retries: int = 5,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+    ):
+        self.client = client
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.chat = _RateLimitedChat(self)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.client, name)
+
+    @staticmethod
+    def estimate_tokens(messages: List[Dict[str, Any]], max_tokens: Optional[int]) -> int:
+        prompt = "".join(str(message.get("content") or "") for message in messages)
+        return count_tokens(prompt) + (max_tokens or 256)
+
+    def create_chat_completion(self, **kwargs: Any) -> Any:
+        import openai
+
+        estimated_tokens = self.estimate_tokens(kwargs.get("messages", []), kwargs.get("max_tokens"))
+
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(estimated_tokens)
+            # a failed request, retried or not, did not use its tokens
+            used_tokens, completion = 0, None
+            try:
+                completion = self.client.chat.completions.create(**kwargs)
+                usage = getattr(completion, "usage", None)
+                used_tokens = getattr(usage, "total_tokens", None)
+                if used_tokens is None:
+                    used_tokens = estimated_tokens
+            except (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError) as e:
+                error = e
+            finally:
+                self.limiter.settle(estimated_tokens, used_tokens, succeeded=completion is not None)
+
+            if completion is not None:
+                return completion
+            if attempt == self.max_retries:
+                raise error
+
+            retry_after = _retry_after(error)
+            metrics.increment("openai_retries", reason=type(error).__name__)
+            if isinstance(error, openai.RateLimitError):
+                # the limiter pauses every caller for Retry-After, so the next acquire() does the waiting
+                self.limiter.throttle(retry_after)
+                if retry_after:
+                    logger.info("OpenAI rate limit hit, retrying in %.2fs", retry_after)
+                    continue
+            # exponential backoff with full jitter
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+            logger.info("OpenAI request failed (%s), retrying in %.2fs", type(error).__name__, delay)
+            time.sleep(delay)
+
+
+def create_openai_client(api_key: str) -> RateLimitedOpenAI:
+    from openai import OpenAI
+
+    # retries are done by the wrapper, which knows about the shared rate limit
+    client = OpenAI(api_key=api_key, timeout=float(os.environ.get("OPENAI_TIMEOUT", 30.0)), max_retries=0)
+    rate_limited_client = RateLimitedOpenAI(
+        client,
+        requests_per_minute=float(os.environ.get("OPENAI_REQUESTS_PER_MINUTE", 500)),
+        tokens_per_minute=float(os.environ.get("OPENAI_TOKENS_PER_MINUTE", 200_000)),
+        max_retries=int(os.environ.get("OPENAI_MAX_RETRIES", 5)),
+    )
+    metrics.register_collector("openai_limiter", rate_limited_client.limiter.stats)
+    return rate_limited_client
@@ -1,13 +1,33 @@
-from .custom_components import QuizParser
-from haystack.components.converters import HTMLToDocument
-from haystack.components.fetchers import LinkContentFetcher
-from haystack.components.generators import OpenAIGenerator
-from haystack.components.builders import PromptBuilder
-from haystack.components.websearch.serper_dev import SerperDevWebSearch
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator
+import os
+import threading
 
-from haystack.utils import Secret
-from haystack import Pipeline
+from .metrics import metrics
 
+# haystack, openai and the HTML converters are slow to import, so they are imported by the
+# pipeline factories below, the first time a pipeline is needed
+if TYPE_CHECKING:
+    from haystack import Pipeline
+    from haystack.dataclasses import StreamingChunk
+
+
+# tokens of page text sent to the quiz generation prompt
+QUIZ_GENERATION_TOKEN_BUDGET = int(os.getenv("QUIZ_GENERATION_TOKEN_BUDGET", 1000))
+
+# pages with more than this many tokens of passages (the text left once menus, footers and link lists are
+# dropped, about 9000 words) are split into sections that get their own, parallel, prompts; shorter pages,
+# most articles, are summarized well enough by the QUIZ_GENERATION_TOKEN_BUDGET tokens of a single prompt
+QUIZ_LONG_DOCUMENT_TOKENS = int(os.getenv("QUIZ_LONG_DOCUMENT_TOKENS", 12000))
+QUIZ_SECTION_TOKENS = int(os.getenv("QUIZ_SECTION_TOKENS", 800))
+QUIZ_MAX_SECTIONS = int(os.getenv("QUIZ_MAX_SECTIONS", 8))
+QUIZ_QUESTIONS_PER_SECTION = 3
+QUIZ_QUESTION_COUNT = 5
+
+# "structured" constrains the reply to the quiz JSON schema, "json" only asks for JSON in the prompt
+QUIZ_GENERATION_MODES = ["structured", "json"]
+QUIZ_GENERATION_MODE = os.getenv("QUIZ_GENERATION_MODE", "structured")
 
 quiz_generation_template = """Dado o seguinte texto, crie 5 questionários de múltipla escolha em formato JSON.
 Cada pergunta deve ter 4 opções diferentes, e apenas uma delas deve estar correta.
@@ -33,30 +53,63 @@ exemplo de formato JSON que você deve seguir absolutamente:
   ]
 }
 texto:
-{% for doc in documents %}{{ doc.content|truncate(4000) }}{% endfor %}
+{% for doc in documents %}{{ doc.content }}{% endfor %}
+"""
+
+
+question_regeneration_template = """Dado o seguinte texto, crie {{ count }} novas perguntas de múltipla escolha em formato JSON sobre "{{ topic }}".
+Cada pergunta deve ter 4 opções diferentes, e apenas uma delas deve estar correta.
+As opções devem ser inequívocas.
+Cada opção deve começar com uma letra seguida por um ponto e um espaço (ex: "a. opção").
+A pergunta também deve mencionar brevemente o tópico geral do texto para que possa ser compreendida isoladamente.
+As novas perguntas não devem repetir nem dar dicas para responder às perguntas que já existem:
+{% for question in questions %}
+- {{ question["question"] }}
+{% endfor %}
+Para cada pergunta, inclua também um campo 'explanation' com um breve texto didático sobre a pergunta e a resposta correta.
+responda apenas com JSON, sem markdown ou descrições.
+exemplo de formato JSON que você deve seguir absolutamente:
+{"questions":
+  [
+    {
+      "question": "texto da pergunta",
+      "options": ["a. 1ª opção", "b. 2ª opção", "c. 3ª opção", "d. 4ª opção"],
+      "right_option": "c",
+      "explanation": "Uma breve explicação do motivo pelo qual a opção 'c' está correta, baseada no texto."
+    }, ...
+  ]
+}
+texto:
+{% for doc in documents %}{{ doc.content }}{% endfor %}
 """
 
 
-quiz_generation_pipeline = Pipeline()
-quiz_generation_pipeline.add_component("link_content_fetcher", LinkContentFetcher())
-quiz_generation_pipeline.add_component("html_converter", HTMLToDocument())
-quiz_generation_pipeline.add_component(
-    "prompt_builder", PromptBuilder(template=quiz_generation_template)
-)
-quiz_generation_pipeline.add_component(
-    "generator",
-    OpenAIGenerator(
-        api_key=Secret.from_env_var("OPENAI_API_KEY"),
-        model="gpt-4o-mini",
-        generation_kwargs={"max_tokens": 1000, "temperature": 0.5, "top_p": 1},
-    ),
-)
-quiz_generation_pipeline.add_component("quiz_parser", QuizParser())
-
-quiz_generation_pipeline.connect("link_content_fetcher", "html_converter")
-quiz_generation_pipeline.connect("html_converter", "prompt_builder")
-quiz_generation_pipeline.connect("prompt_builder", "generator")
-quiz_generation_pipeline.connect("generator", "quiz_parser")
+section_question_template = """Dado o seguinte trecho de um texto mais longo, crie {{ count }} perguntas de múltipla escolha em formato JSON sobre o trecho.
+Cada pergunta deve ter 4 opções diferentes, e apenas uma delas deve estar correta.
+As opções devem ser inequívocas.
+Cada opção deve começar com uma letra seguida por um ponto e um espaço (ex: "a. opção").
+A pergunta também deve mencionar brevemente o tópico geral do texto para que possa ser compreendida isoladamente.
+Cada pergunta não deve dar dicas para responder às outras perguntas.
+Varie a dificuldade das perguntas e indique-a no campo 'difficulty': 1 (fácil), 2 (média) ou 3 (difícil).
+Varie a letra ("a.", "b." etc.) da resposta correta.
+Para cada pergunta, inclua também um campo 'explanation' com um breve texto didático sobre a pergunta e a resposta correta.
+responda apenas com JSON, sem markdown ou descrições.
+exemplo de formato JSON que você deve seguir absolutamente:
+{"topic": "uma frase explicando o tópico geral do texto",
+ "questions":
+  [
+    {
+      "question": "texto da pergunta",
+      "options": ["a. 1ª opção", "b. 2ª opção", "c. 3ª opção", "d. 4ª opção"],
+      "right_option": "c",
+      "explanation": "Uma breve explicação do motivo pelo qual a opção 'c' está correta, baseada no texto.",
+      "difficulty": 2
+    }, ...
+  ]
+}
+trecho:
+{{ section.content }}
+"""
 
 
 closed_book_template = """Responda à seguinte pergunta, especificando uma das opções.
@@ -74,19 +127,23 @@ opções: {{ question["options"] }}
 opção escolhida (a, b, c, ou d):
 """
 
-closed_book_answer_pipeline = Pipeline()
-closed_book_answer_pipeline.add_component(
-    "prompt_builder", PromptBuilder(template=closed_book_template)
-)
-closed_book_answer_pipeline.add_component(
-    "generator",
-    OpenAIGenerator(
-        api_key=Secret.from_env_var("OPENAI_API_KEY"),
-        model="gpt-4o-mini",
-        generation_kwargs={"max_tokens": 5, "temperature": 0, "top_p": 1},
-    ),
-)
-closed_book_answer_pipeline.connect("prompt_builder", "generator")
+
+batched_closed_book_template = """Responda às seguintes perguntas, especificando uma das opções para cada uma.
+O tópico é: {{ topic }}.
+
+Para cada pergunta, especifique apenas a letra correspondente à opção.
+Se você não souber a resposta, apenas forneça seu melhor palpite e não forneça nenhum raciocínio.
+
+Responda apenas com uma lista JSON contendo uma letra por pergunta, na mesma ordem das perguntas.
+Por exemplo, para 3 perguntas: ["a", "c", "b"]
+
+{% for question in questions %}
+pergunta {{ loop.index }}: {{ question["question"] }}
+opções: {{ question["options"] }}
+{% endfor %}
+
+lista de opções escolhidas ({{ questions|length }} letras entre a, b, c, ou d):
+"""
 
 
 web_rag_template = """Responda à pergunta sobre "{{topic}}", usando seu conhecimento e os trechos extraídos da web.
@@ -107,21 +164,253 @@ Trechos:
 
 opção escolhida (a, b, c, ou d):
 """
-web_rag_pipeline = Pipeline()
-# Reativando o pipeline web_rag com as chaves API configuradas
-web_rag_pipeline.add_component(
-    "websearch", SerperDevWebSearch(top_k=3)
-)
-web_rag_pipeline.add_component(
-    "prompt_builder", PromptBuilder(template=web_rag_template)
-)
-web_rag_pipeline.add_component(
-    "generator",
-    OpenAIGenerator(
-        api_key=Secret.from_env_var("OPENAI_API_KEY"),
-        model="gpt-4o-mini",
-        generation_kwargs={"max_tokens": 5, "temperature": 0, "top_p": 1},
-    ),
-)
-web_rag_pipeline.connect("websearch.documents", "prompt_builder.documents")
-web_rag_pipeline.connect("prompt_builder", "generator")
+
+
+local_rag_template = """Responda à pergunta sobre "{{topic}}", usando seu conhecimento e os trechos extraídos do texto de origem.
+
+Na resposta, especifique apenas a letra correspondente à opção.
+Se você não souber a resposta, apenas forneça seu melhor palpite e não forneça nenhum raciocínio.
+
+Por exemplo, se você acha que a resposta é a primeira opção, escreva apenas "a".
+Se você acha que a resposta é a segunda opção, escreva apenas "b", e assim por diante.
+
+pergunta: {{ question["question"] }}
+opções: {{ question["options"] }}
+
+Trechos:
+{% for doc in documents %}
+- trecho: "{{doc.content}}"
+{% endfor %}
+
+opção escolhida (a, b, c, ou d):
+"""
+
+
+@lru_cache(maxsize=None)
+def get_openai_client():
+    from haystack.utils import Secret
+    from .cassette import CassetteOpenAI, with_cassette
+    from .openai_client import create_openai_client
+
+    # one client for the whole process: pooled connections, a shared rate limit and retries with backoff,
+    # under the record/replay cassette when QUIZ_CASSETTE is set
+    return with_cassette(create_openai_client(Secret.from_env_var("OPENAI_API_KEY").resolve_value()), CassetteOpenAI)
+
+
+def _openai_generator(**kwargs: Any):
+    from haystack.components.generators import OpenAIGenerator
+    from haystack.utils import Secret
+
+    generator = OpenAIGenerator(
+        api_key=Secret.from_env_var("OPENAI_API_KEY"), model="gpt-4o-mini", **kwargs
+    )
+    # all pipelines share one client, so keep-alive connections and the rate limit are shared across them
+    generator.client = get_openai_client()
+    return generator
+
+
+# the streaming generator is shared by every session, so each thread registers its own chunk handler
+_stream_handlers = threading.local()
+
+
+@contextmanager
+def stream_to(handler: Callable[[str], None]) -> Iterator[None]:
+    _stream_handlers.handler = handler
+    try:
+        yield
+    finally:
+        _stream_handlers.handler = None
+
+
+def _dispatch_streaming_chunk(chunk: "StreamingChunk") -> None:
+    handler = getattr(_stream_handlers, "handler", None)
+    if handler is not None:
+        handler(chunk.content)
+
+
+@lru_cache(maxsize=None)
+def get_document_fetch_pipeline() -> "Pipeline":
+    from haystack import Pipeline
+    from .custom_components import CachedDocumentFetcher
+
+    # fetching and HTML conversion are done by one component, so that a 304 can reuse the converted documents
+    document_fetcher = CachedDocumentFetcher()
+    metrics.register_collector("document_fetcher", document_fetcher.stats)
+
+    document_fetch_pipeline = Pipeline()
+    document_fetch_pipeline.add_component("document_fetcher", document_fetcher)
+
+    return document_fetch_pipeline
+
+
+def _build_quiz_generation_pipeline(
+    template: str, schema_name: str, schema: Dict[str, Any], require_topic: bool = True, **generator_kwargs: Any
+) -> "Pipeline":
+    from haystack import Pipeline
+    from haystack.components.builders import PromptBuilder
+    from .custom_components import PassageSelector, QuizParser, QuizValidator
+    from .quiz_schema import response_format
+
+    if QUIZ_GENERATION_MODE not in QUIZ_GENERATION_MODES:
+        raise ValueError(
+            f"Unknown quiz generation mode '{QUIZ_GENERATION_MODE}', expected one of {QUIZ_GENERATION_MODES}"
+        )
+
+    generation_kwargs = {"max_tokens": 1000, "temperature": 0.5, "top_p": 1}
+    if QUIZ_GENERATION_MODE == "structured":
+        generation_kwargs["response_format"] = response_format(schema_name, schema)
+
+    quiz_generation_pipeline = Pipeline()
+    # instead of the first characters of the page, the prompt gets its most relevant passages within a token budget
+    quiz_generation_pipeline.add_component(
+        "passage_selector", PassageSelector(token_budget=QUIZ_GENERATION_TOKEN_BUDGET)
+    )
+    quiz_generation_pipeline.add_component(
+        "prompt_builder", PromptBuilder(template=template)
+    )
+    quiz_generation_pipeline.add_component(
+        "generator",
+        _openai_generator(generation_kwargs=generation_kwargs, **generator_kwargs),
+    )
+    quiz_generation_pipeline.add_component("quiz_parser", QuizParser())
+    quiz_generation_pipeline.add_component("quiz_validator", QuizValidator(require_topic=require_topic))
+
+    quiz_generation_pipeline.connect("passage_selector", "prompt_builder")
+    quiz_generation_pipeline.connect("prompt_builder", "generator")
+    quiz_generation_pipeline.connect("generator", "quiz_parser")
+    quiz_generation_pipeline.connect("quiz_parser", "quiz_validator")
+
+    return quiz_generation_pipeline
+
+
+@lru_cache(maxsize=None)
+def get_quiz_generation_pipeline() -> "Pipeline":
+    from .quiz_schema import QUIZ_SCHEMA
+
+    return _build_quiz_generation_pipeline(quiz_generation_template, "quiz", QUIZ_SCHEMA)
+
+
+@lru_cache(maxsize=None)
+def get_streaming_quiz_generation_pipeline() -> "Pipeline":
+    from .quiz_schema import QUIZ_SCHEMA
+
+    return _build_quiz_generation_pipeline(
+        quiz_generation_template, "quiz", QUIZ_SCHEMA, streaming_callback=_dispatch_streaming_chunk
+    )
+
+
+@lru_cache(maxsize=None)
+def get_question_regeneration_pipeline() -> "Pipeline":
+    from .quiz_schema import QUESTIONS_SCHEMA
+
+    # generates replacements for the invalid questions of a quiz, instead of generating the whole quiz again
+    return _build_quiz_generation_pipeline(
+        question_regeneration_template, "questions", QUESTIONS_SCHEMA, require_topic=False
+    )
+
+
+@lru_cache(maxsize=None)
+def get_section_question_pipeline() -> "Pipeline":
+    from haystack import Pipeline
+    from haystack.components.builders import PromptBuilder
+    from .custom_components import QuizParser
+    from .quiz_schema import SECTION_QUESTIONS_SCHEMA, response_format
+
+    # generates candidate questions for one section of a long document (see generate_long_document_quiz)
+    generation_kwargs = {"max_tokens": 250 * QUIZ_QUESTIONS_PER_SECTION, "temperature": 0.5, "top_p": 1}
+    if QUIZ_GENERATION_MODE == "structured":
+        generation_kwargs["response_format"] = response_format("section_questions", SECTION_QUESTIONS_SCHEMA)
+
+    section_question_pipeline = Pipeline()
+    section_question_pipeline.add_component(
+        "prompt_builder", PromptBuilder(template=section_question_template)
+    )
+    section_question_pipeline.add_component("generator", _openai_generator(generation_kwargs=generation_kwargs))
+    section_question_pipeline.add_component("quiz_parser", QuizParser())
+    section_question_pipeline.connect("prompt_builder", "generator")
+    section_question_pipeline.connect("generator", "quiz_parser")
+
+    return section_question_pipeline
+
+
+@lru_cache(maxsize=None)
+def get_closed_book_answer_pipeline() -> "Pipeline":
+    from haystack import Pipeline
+    from haystack.components.builders import PromptBuilder
+
+    closed_book_answer_pipeline = Pipeline()
+    closed_book_answer_pipeline.add_component(
+        "prompt_builder", PromptBuilder(template=closed_book_template)
+    )
+    closed_book_answer_pipeline.add_component(
+        "generator",
+        _openai_generator(generation_kwargs={"max_tokens": 5, "temperature": 0, "top_p": 1}),
+    )
+    closed_book_answer_pipeline.connect("prompt_builder", "generator")
+
+    return closed_book_answer_pipeline
+
+
+@lru_cache(maxsize=None)
+def get_batched_closed_book_answer_pipeline() -> "Pipeline":
+    from haystack import Pipeline
+    from haystack.components.builders import PromptBuilder
+    from .custom_components import AnswerListParser
+
+    batched_closed_book_answer_pipeline = Pipeline()
+    batched_closed_book_answer_pipeline.add_component(
+        "prompt_builder", PromptBuilder(template=batched_closed_book_template)
+    )
+    batched_closed_book_answer_pipeline.add_component(
+        "generator",
+        _openai_generator(generation_kwargs={"max_tokens": 100, "temperature": 0, "top_p": 1}),
+    )
+    batched_closed_book_answer_pipeline.add_component("answer_parser", AnswerListParser())
+    batched_closed_book_answer_pipeline.connect("prompt_builder", "generator")
+    batched_closed_book_answer_pipeline.connect("generator", "answer_parser")
+
+    return batched_closed_book_answer_pipeline
+
+
+@lru_cache(maxsize=None)
+def get_web_rag_pipeline() -> "Pipeline":
+    from haystack import Pipeline
+    from haystack.components.builders import PromptBuilder
+    from .custom_components import CachedWebSearch
+
+    websearch = CachedWebSearch(top_k=3)
+    metrics.register_collector("search_cache", websearch.stats)
+
+    web_rag_pipeline = Pipeline()
+    web_rag_pipeline.add_component("websearch", websearch)
+    web_rag_pipeline.add_component(
+        "prompt_builder", PromptBuilder(template=web_rag_template)
+    )
+    web_rag_pipeline.add_component(
+        "generator",
+        _openai_generator(generation_kwargs={"max_tokens": 5, "temperature": 0, "top_p": 1}),
+    )
+    web_rag_pipeline.connect("websearch.documents", "prompt_builder.documents")
+    web_rag_pipeline.connect("prompt_builder", "generator")
+
+    return web_rag_pipeline
+
+
+@lru_cache(maxsize=None)
+def get_local_rag_pipeline() -> "Pipeline":
+    from haystack import Pipeline
+    from haystack.components.builders import PromptBuilder
+
+    # the passages are retrieved from the quiz's own source page (see get_local_rag_answers_and_snippets),
+    # so this pipeline starts at the prompt
+    local_rag_pipeline = Pipeline()
+    local_rag_pipeline.add_component(
+        "prompt_builder", PromptBuilder(template=local_rag_template)
+    )
+    local_rag_pipeline.add_component(
+        "generator",
+        _openai_generator(generation_kwargs={"max_tokens": 5, "temperature": 0, "top_p": 1}),
+    )
+    local_rag_pipeline.connect("prompt_builder", "generator")
+
+    return local_rag_pipeline
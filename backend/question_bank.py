@@ -0,0 +1,402 @@
+"""
+A persistent bank of every generated question, so that questions already paid for can be served again.
+
+Rephrased duplicates are merged when they are stored: every question has a MinHash signature of its words,
+and the signatures are indexed by LSH bands (locality-sensitive hashing), so the near-duplicates of a new
+question are found by reading a few index rows instead of comparing it with every stored question.
+Questions are also indexed by the pages they were generated from and by the words of their quiz topic, so a
+quiz for a page or a topic is assembled from the bank with a couple of indexed queries. A page is a URL at a
+version: the key of its content and of the generation settings (see utils.quiz_cache_key). Each version also
+keeps a MinHash signature of its passages, so a quiz for a slightly edited page is assembled from the
+questions of its similar versions, but never from those of other prompts or models.
+
+    python -m backend.question_bank             # size of the bank and the questions by source, as JSON
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from .cache import DEFAULT_CACHE_DIR
+from .custom_components import normalize_query, split_passages
+from .quiz_schema import validate_question
+
+NUM_PERMUTATIONS = 128
+
+# 32 bands of 4 rows: two questions become candidates when one band of their signatures is equal, which is
+# likely above a similarity of about (1 / 32) ** (1 / 4) = 0.42; the candidates are then checked exactly
+LSH_BANDS = 32
+LSH_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+
+# the smallest prime above 2**32: with 32-bit word hashes and coefficients below 2**31, a * x + b fits in 64 bits
+_PRIME = np.uint64(4294967311)
+
+# fixed coefficients, so that signatures stored by an earlier run stay comparable
+_coefficients = np.frombuffer(
+    hashlib.shake_128(b"question-bank-minhash").digest(NUM_PERMUTATIONS * 2 * 8), dtype="<u8"
+).reshape(2, NUM_PERMUTATIONS)
+_A = _coefficients[0] % np.uint64((1 << 31) - 1) + np.uint64(1)
+_B = _coefficients[1] >> np.uint64(32)
+
+
+def question_words(question: Dict[str, Any]) -> List[str]:
+    """
+    The words a question is compared by: those of its text, without accents. The answer is left out: two
+    questions about the same subject often share it ("who founded the band?", "who is its singer?").
+    """
+    words = normalize_query(question.get("question", "")).split()
+    # short words are mostly articles and prepositions, which rephrasing changes freely
+    return [word for word in words if len(word) > 2] or words
+
+
+def minhash(words: Iterable[str]) -> np.ndarray:
+    """The MinHash signature of a set of words; the fraction of equal positions estimates their Jaccard similarity."""
+    hashes = np.array(sorted({zlib.crc32(word.encode("utf-8")) for word in words}), dtype=np.uint64)
+    if hashes.size == 0:
+        return np.full(NUM_PERMUTATIONS, _PRIME, dtype=np.uint64)
+    return ((_A[:, None] * hashes[None, :] + _B[:, None]) % _PRIME).min(axis=1)
+
+
+def lsh_buckets(signature: np.ndarray) -> List[int]:
+    """One bucket per band; the band number is part of the bucket, so equal rows in different bands don't collide."""
+    buckets = []
+    for band in range(LSH_BANDS):
+        rows = signature[band * LSH_ROWS : (band + 1) * LSH_ROWS].tobytes()
+        digest = hashlib.blake2b(band.to_bytes(2, "little") + rows, digest_size=8).digest()
+        buckets.append(int.from_bytes(digest, "little", signed=True))
+    return buckets
+
+
+def topic_terms(topic: str) -> List[str]:
+    return sorted({f"topic:{word}" for word in normalize_query(topic).split() if len(word) > 2})
+
+
+def page_signature(texts: Iterable[str]) -> np.ndarray:
+    """
+    The MinHash signature of the 3-word shingles of a page's passages, without the menus and link lists
+    that change between two fetches of the same page.
+    """
+    words = [word for text in texts for passage in split_passages(text) for word in normalize_query(passage).split()]
+    return minhash(" ".join(words[i : i + 3]) for i in range(max(1, len(words) - 2)))
+
+
+def source_term(url: str, version: str) -> str:
+    return f"source:{url}#{version}"
+
+
+def _term_url(term: str) -> str:
+    # URLs can have a fragment, versions can't
+    url, separator, _ = term[len("source:") :].rpartition("#")
+    return url if separator else term[len("source:") :]
+
+
+class QuestionBank:
+    """
+    Stores questions next to the cache database, merging each new question into a stored one when their
+    estimated similarity is at least `duplicate_similarity`. A merged question keeps its first wording and
+    gains the sources and topic of the new one.
+
+    A question is fresh for `max_age` seconds after it was last generated, from any source; only fresh
+    questions are used to assemble quizzes. The quiz of a page is assembled from the questions of its
+    versions whose estimated similarity to it is at least `page_similarity`.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        duplicate_similarity: float = 0.7,
+        max_age: float = 7 * 24 * 3600,
+        page_similarity: float = 0.9,
+    ):
+        self.path = path or os.path.join(DEFAULT_CACHE_DIR, "question_bank.sqlite3")
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.duplicate_similarity = duplicate_similarity
+        self.max_age = max_age
+        self.page_similarity = page_similarity
+
+        self.added = 0
+        self.merged = 0
+        self.lookups = 0
+        self.served = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS questions (
+                    id INTEGER PRIMARY KEY,
+                    question TEXT NOT NULL,
+                    topic TEXT NOT NULL,
+                    signature BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    generated_at REAL NOT NULL,
+                    generated INTEGER NOT NULL DEFAULT 1
+                )"""
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS lsh_buckets (bucket INTEGER NOT NULL, question_id INTEGER NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS lsh_buckets_bucket ON lsh_buckets (bucket)")
+            # the inverted index: "source:<url>#<version>" and "topic:<word>" terms
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS terms (
+                    term TEXT NOT NULL,
+                    question_id INTEGER NOT NULL,
+                    PRIMARY KEY (term, question_id)
+                ) WITHOUT ROWID"""
+            )
+            # the versions of the pages: their source term, generation settings and content signature
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS pages (
+                    term TEXT PRIMARY KEY,
+                    source TEXT NOT NULL,
+                    settings TEXT NOT NULL,
+                    signature BLOB NOT NULL
+                ) WITHOUT ROWID"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS pages_source ON pages (source, settings)")
+
+    def _find_duplicate(self, signature: np.ndarray, buckets: List[int]) -> Optional[int]:
+        placeholders = ",".join("?" * len(buckets))
+        rows = self._conn.execute(
+            f"""SELECT id, signature FROM questions WHERE id IN (
+                SELECT question_id FROM lsh_buckets WHERE bucket IN ({placeholders})
+            )""",
+            buckets,
+        ).fetchall()
+
+        best_id, best_similarity = None, self.duplicate_similarity
+        for question_id, blob in rows:
+            similarity = float((np.frombuffer(blob, dtype=np.uint64) == signature).mean())
+            if similarity >= best_similarity:
+                best_id, best_similarity = question_id, similarity
+        return best_id
+
+    def add(
+        self,
+        quiz: Dict[str, Any],
+        source: str,
+        version: str,
+        settings: Optional[str] = None,
+        content: Optional[Sequence[str]] = None,
+    ) -> List[int]:
+        """
+        Stores the valid questions of a quiz generated from version `version` of the page at `source` and
+        returns their ids, in order; the id of a question merged into a stored duplicate is that of the
+        stored question. Given the generation `settings` and the `content` of the page, the version can be
+        matched by the quizzes of similar versions (see assemble).
+        """
+        now = time.time()
+        terms = [source_term(source, version)] + topic_terms(quiz["topic"])
+        ids = []
+        if settings is not None and content is not None:
+            self._add_page(terms[0], source, settings, content)
+        with self._lock, self._conn:
+            for question in quiz["questions"]:
+                if validate_question(question):
+                    continue
+                signature = minhash(question_words(question))
+                buckets = lsh_buckets(signature)
+
+                question_id = self._find_duplicate(signature, buckets)
+                if question_id is not None:
+                    self._conn.execute(
+                        "UPDATE questions SET generated_at = ?, generated = generated + 1 WHERE id = ?",
+                        (now, question_id),
+                    )
+                    self.merged += 1
+                else:
+                    question_id = self._conn.execute(
+                        """INSERT INTO questions (question, topic, signature, created_at, generated_at)
+                        VALUES (?, ?, ?, ?, ?)""",
+                        (json.dumps(question, ensure_ascii=False), quiz["topic"], signature.tobytes(), now, now),
+                    ).lastrowid
+                    self._conn.executemany(
+                        "INSERT INTO lsh_buckets (bucket, question_id) VALUES (?, ?)",
+                        [(bucket, question_id) for bucket in buckets],
+                    )
+                    self.added += 1
+
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO terms (term, question_id) VALUES (?, ?)",
+                    [(term, question_id) for term in terms],
+                )
+                ids.append(question_id)
+        return ids
+
+    def link(
+        self,
+        question_ids: Sequence[int],
+        source: str,
+        version: str,
+        settings: Optional[str] = None,
+        content: Optional[Sequence[str]] = None,
+    ) -> None:
+        """
+        Links stored questions to version `version` of the page at `source`, for the questions of similar
+        versions that were served for it, so that its next versions can drift further from the first one.
+        """
+        term = source_term(source, version)
+        if settings is not None and content is not None:
+            self._add_page(term, source, settings, content)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO terms (term, question_id) VALUES (?, ?)",
+                [(term, question_id) for question_id in question_ids],
+            )
+
+    def _add_page(self, term: str, source: str, settings: str, content: Sequence[str]) -> None:
+        with self._lock:
+            known = self._conn.execute("SELECT 1 FROM pages WHERE term = ?", (term,)).fetchone()
+        if known:
+            return
+        signature = page_signature(content)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO pages (term, source, settings, signature) VALUES (?, ?, ?, ?)",
+                (term, source, settings, signature.tobytes()),
+            )
+
+    def _similar_pages(self, source: str, settings: str, content: Sequence[str]) -> List[str]:
+        signature = page_signature(content)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT term, signature FROM pages WHERE source = ? AND settings = ?", (source, settings)
+            ).fetchall()
+        return [
+            term
+            for term, blob in rows
+            if float((np.frombuffer(blob, dtype=np.uint64) == signature).mean()) >= self.page_similarity
+        ]
+
+    def assemble(
+        self,
+        source: Optional[str] = None,
+        version: Optional[str] = None,
+        topic: Optional[str] = None,
+        count: int = 5,
+        exclude: Sequence[int] = (),
+        settings: Optional[str] = None,
+        content: Optional[Sequence[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Returns up to `count` fresh questions generated from version `version` of `source`, or about `topic`,
+        as dicts with the question's "id", "topic" and "question". Given the generation `settings` and the
+        `content` of the page, the questions of its versions with the same settings and a similar content
+        are returned too. Questions of a source come in the order they were generated; questions of a topic
+        are those matching most of its words first.
+        """
+        if (source is None) == (topic is None) or (source is None) != (version is None):
+            raise ValueError("Give either a source and its version, or a topic")
+
+        fresh_since = time.time() - self.max_age
+        if source is not None:
+            terms = [source_term(source, version)]
+            if settings is not None and content is not None:
+                terms += [term for term in self._similar_pages(source, settings, content) if term != terms[0]]
+            min_matches = 1
+        else:
+            terms = topic_terms(topic)
+            if not terms:
+                return []
+            min_matches = math.ceil(len(terms) / 2)
+
+        placeholders = ",".join("?" * len(terms))
+        with self._lock:
+            self.lookups += 1
+            rows = self._conn.execute(
+                f"""SELECT q.id, q.topic, q.question, COUNT(*) AS matches
+                FROM terms t JOIN questions q ON q.id = t.question_id
+                WHERE t.term IN ({placeholders}) AND q.generated_at >= ?
+                GROUP BY q.id HAVING matches >= ?
+                ORDER BY matches DESC, q.generated DESC, q.id""",
+                [*terms, fresh_since, min_matches],
+            ).fetchall()
+
+        excluded = set(exclude)
+        entries = [
+            {"id": question_id, "topic": question_topic, "question": json.loads(question)}
+            for question_id, question_topic, question, _ in rows
+            if question_id not in excluded
+        ]
+        # questions stored by an older version of the app may not be valid anymore
+        entries = [entry for entry in entries if not validate_question(entry["question"])]
+
+        if source is not None:
+            # a source with more questions than needed gives a different selection every time, in generation order
+            if len(entries) > count:
+                entries = sorted(random.sample(entries, count), key=lambda entry: entry["id"])
+        else:
+            entries = entries[:count]
+
+        with self._lock:
+            self.served += len(entries)
+        return entries
+
+    def sources(self, question_id: int) -> List[str]:
+        """The URLs a question was generated from, from any version of their pages."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT term FROM terms WHERE question_id = ? AND term LIKE 'source:%' ORDER BY term",
+                (question_id,),
+            ).fetchall()
+        return list(dict.fromkeys(_term_url(term) for term, in rows))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            questions, sources, pages = self._conn.execute(
+                """SELECT (SELECT COUNT(*) FROM questions),
+                (SELECT COUNT(*) FROM terms WHERE term LIKE 'source:%'),
+                (SELECT COUNT(*) FROM pages)"""
+            ).fetchone()
+            return {
+                "questions": questions,
+                "source_links": sources,
+                "page_versions": pages,
+                "added": self.added,
+                "merged": self.merged,
+                "lookups": self.lookups,
+                "served": self.served,
+            }
+
+    def source_counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT term, COUNT(*) FROM terms WHERE term LIKE 'source:%' GROUP BY term"
+            ).fetchall()
+        counts = Counter()
+        for term, count in rows:
+            counts[_term_url(term)] += count
+        return dict(counts.most_common())
+
+
+def most_common_topic(entries: List[Dict[str, Any]]) -> str:
+    return Counter(entry["topic"] for entry in entries).most_common(1)[0][0]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Size of the question bank and its questions by source.")
+    parser.add_argument("--path", help="question bank database (default: question_bank.sqlite3 in QUIZ_CACHE_DIR)")
+    args = parser.parse_args(argv)
+
+    bank = QuestionBank(args.path)
+    print(json.dumps({**bank.stats(), "sources": bank.source_counts()}, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .cache import hash_key
+
+OPTION_LETTERS = "abcd"
+
+# the index of an unanswered question, or of an answer that is not one of the options
+UNANSWERED = -1
+
+
+def encode_answer(answer: Optional[str]) -> int:
+    """Maps "b", "B" or a full option label like "b. texto" to its index, anything else to UNANSWERED."""
+    if not answer:
+        return UNANSWERED
+    index = OPTION_LETTERS.find(answer.strip()[:1].lower())
+    return index if index >= 0 else UNANSWERED
+
+
+class Question:
+    __slots__ = ("text", "options", "right_index", "explanation")
+
+    def __init__(self, text: str, options: Sequence[str], right_index: int, explanation: str = ""):
+        self.text = text
+        self.options = tuple(options)
+        self.right_index = right_index
+        self.explanation = explanation
+
+    @classmethod
+    def from_dict(cls, question: Dict[str, Any]) -> "Question":
+        right_index = encode_answer(question["right_option"])
+        # an unknown right option would index the last option, and score unanswered questions as right
+        if not 0 <= right_index < len(question["options"]):
+            raise ValueError(f"Invalid right option {question['right_option']!r} for {question['question']!r}")
+        return cls(question["question"], question["options"], right_index, question.get("explanation") or "")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "question": self.text,
+            "options": list(self.options),
+            "right_option": self.right_option,
+            "explanation": self.explanation,
+        }
+
+    @property
+    def right_option(self) -> str:
+        return OPTION_LETTERS[self.right_index]
+
+    @property
+    def right_answer(self) -> str:
+        return self.options[self.right_index]
+
+    def option(self, index: int) -> Optional[str]:
+        return self.options[index] if 0 <= index < len(self.options) else None
+
+
+class Quiz:
+    """
+    A quiz with its answers stored as option indices, so that attempts can be scored as NumPy arrays
+    (see backend.scoring). `key` identifies the quiz by its content, for storing attempts.
+    """
+
+    __slots__ = ("topic", "questions", "answer_key", "key")
+
+    def __init__(self, topic: str, questions: Iterable[Question]):
+        self.topic = topic
+        self.questions: Tuple[Question, ...] = tuple(questions)
+        self.answer_key = np.array([question.right_index for question in self.questions], dtype=np.int8)
+        self.key = hash_key(topic, [(question.text, question.options) for question in self.questions])
+
+    @classmethod
+    def from_dict(cls, quiz: Dict[str, Any]) -> "Quiz":
+        return cls(quiz["topic"], [Question.from_dict(question) for question in quiz["questions"]])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"topic": self.topic, "questions": [question.to_dict() for question in self.questions]}
+
+    def __len__(self) -> int:
+        return len(self.questions)
+
+    def encode_answers(self, answers: Sequence[Optional[str]]) -> np.ndarray:
+        """The answer vector of one attempt; missing entries are UNANSWERED and extra ones are dropped."""
+        encoded = np.full(len(self.questions), UNANSWERED, dtype=np.int8)
+        for i, answer in enumerate(answers[: len(self.questions)]):
+            encoded[i] = encode_answer(answer)
+        return encoded
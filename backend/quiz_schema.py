@@ -0,0 +1,168 @@
+import re
+from typing import Any, Callable, Dict, List
+
+OPTION_LETTERS = ["a", "b", "c", "d"]
+
+QUESTION_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "question": {"type": "string", "pattern": r"\S"},
+        "options": {
+            "type": "array",
+            "items": {"type": "string", "pattern": r"^[a-d]\. \S"},
+            "minItems": 4,
+            "maxItems": 4,
+        },
+        "right_option": {"type": "string", "enum": OPTION_LETTERS},
+        "explanation": {"type": "string", "pattern": r"\S"},
+    },
+    "required": ["question", "options", "right_option", "explanation"],
+    "additionalProperties": False,
+}
+
+QUIZ_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "topic": {"type": "string", "pattern": r"\S"},
+        "questions": {"type": "array", "items": QUESTION_SCHEMA},
+    },
+    "required": ["topic", "questions"],
+    "additionalProperties": False,
+}
+
+# the reply format used to generate replacements for invalid questions
+QUESTIONS_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {"questions": {"type": "array", "items": QUESTION_SCHEMA}},
+    "required": ["questions"],
+    "additionalProperties": False,
+}
+
+
+# the reply format of the per-section prompts of long documents: questions also rate their difficulty
+SECTION_QUESTION_SCHEMA: Dict[str, Any] = {
+    **QUESTION_SCHEMA,
+    "properties": {**QUESTION_SCHEMA["properties"], "difficulty": {"type": "integer", "enum": [1, 2, 3]}},
+    "required": QUESTION_SCHEMA["required"] + ["difficulty"],
+}
+
+SECTION_QUESTIONS_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "topic": {"type": "string", "pattern": r"\S"},
+        "questions": {"type": "array", "items": SECTION_QUESTION_SCHEMA},
+    },
+    "required": ["topic", "questions"],
+    "additionalProperties": False,
+}
+
+
+def response_format(name: str, schema: Dict[str, Any]) -> Dict[str, Any]:
+    """The OpenAI `response_format` that constrains the reply to `schema` (structured outputs, strict mode)."""
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
+
+
+Validator = Callable[[Any, str], List[str]]
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+}
+
+
+def compile_schema(schema: Dict[str, Any]) -> Validator:
+    """
+    Compiles the subset of JSON schema used above into a tree of closures, once, so that validating a quiz
+    doesn't interpret the schema again. The returned function takes a value and its path, and returns the
+    list of errors (empty when the value is valid).
+    """
+    checks: List[Validator] = []
+
+    expected_type = schema.get("type")
+    if expected_type is not None:
+        python_type = _TYPES[expected_type]
+
+        def check_type(value, path):
+            if not isinstance(value, python_type) or (expected_type != "boolean" and isinstance(value, bool)):
+                return [f"{path}: expected {expected_type}"]
+            return []
+
+        checks.append(check_type)
+
+    if "enum" in schema:
+        allowed = frozenset(schema["enum"])
+        checks.append(lambda value, path: [] if value in allowed else [f"{path}: expected one of {sorted(allowed)}"])
+
+    if "pattern" in schema:
+        pattern = re.compile(schema["pattern"])
+        checks.append(
+            lambda value, path: [] if pattern.search(value) else [f"{path}: does not match {pattern.pattern!r}"]
+        )
+
+    if "minItems" in schema or "maxItems" in schema:
+        min_items = schema.get("minItems", 0)
+        max_items = schema.get("maxItems", float("inf"))
+        checks.append(
+            lambda value, path: []
+            if min_items <= len(value) <= max_items
+            else [f"{path}: expected {min_items} to {max_items} items, got {len(value)}"]
+        )
+
+    if "items" in schema:
+        validate_item = compile_schema(schema["items"])
+
+        def check_items(value, path):
+            errors = []
+            for i, item in enumerate(value):
+                errors.extend(validate_item(item, f"{path}[{i}]"))
+            return errors
+
+        checks.append(check_items)
+
+    if "properties" in schema:
+        properties = {key: compile_schema(subschema) for key, subschema in schema["properties"].items()}
+        required = schema.get("required", [])
+        closed = schema.get("additionalProperties") is False
+
+        def check_properties(value, path):
+            errors = [f"{path}: missing {key!r}" for key in required if key not in value]
+            for key, item in value.items():
+                if key in properties:
+                    errors.extend(properties[key](item, f"{path}.{key}"))
+                elif closed:
+                    errors.append(f"{path}: unexpected {key!r}")
+            return errors
+
+        checks.append(check_properties)
+
+    def validate(value: Any, path: str = "$") -> List[str]:
+        for check in checks:
+            errors = check(value, path)
+            # the later checks assume the earlier ones (the type above all) passed
+            if errors:
+                return errors
+        return []
+
+    return validate
+
+
+_validate_question_schema = compile_schema(QUESTION_SCHEMA)
+
+
+def validate_question(question: Any, path: str = "$") -> List[str]:
+    """Returns what is wrong with a question: its schema, and the rules the schema can't express."""
+    errors = _validate_question_schema(question, path)
+    if errors:
+        return errors
+
+    # the app takes the first character of an option as its letter, so the options must be in order
+    for i, (letter, option) in enumerate(zip(OPTION_LETTERS, question["options"])):
+        if not option.startswith(f"{letter}."):
+            errors.append(f"{path}.options[{i}]: expected to start with '{letter}.'")
+    if len({option[2:].strip().casefold() for option in question["options"]}) < len(question["options"]):
+        errors.append(f"{path}.options: repeated options")
+    return errors
@@ -0,0 +1,183 @@
+"""
+Scores quiz attempts and computes per-question statistics over many attempts at once.
+
+Attempts are int8 matrices with one row per attempt and one column per question, holding the index of the
+chosen option (UNANSWERED for none). Every player, the user or an LLM mode, is scored by the same code.
+
+    python -m backend.scoring            # statistics of every quiz in the attempt store, one JSON line per quiz
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .cache import DEFAULT_CACHE_DIR
+from .quiz import OPTION_LETTERS, UNANSWERED, Quiz
+
+
+def score_attempts(answer_key: np.ndarray, answers: np.ndarray) -> Dict[str, np.ndarray]:
+    """Scores a (attempts, questions) answer matrix, or a single answer vector, against the answer key."""
+    answers = np.atleast_2d(answers)
+    correct = answers == answer_key
+    scores = correct.sum(axis=1)
+    return {
+        "correct": correct,
+        "scores": scores,
+        "fractions": scores / max(len(answer_key), 1),
+    }
+
+
+def question_stats(answer_key: np.ndarray, answers: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Per-question statistics of classical test theory over all attempts:
+
+    - difficulty: the fraction of attempts that got the question right (lower is harder)
+    - discrimination: the correlation between getting the question right and the score on the other
+      questions; questions that good players miss and weak players get right have a negative value.
+      NaN when it is undefined (everybody right, everybody wrong, or a single question).
+    - answered: the fraction of attempts that answered the question
+    - option_counts: how many attempts chose each option, shape (questions, options)
+    """
+    answers = np.atleast_2d(answers)
+    correct = (answers == answer_key).astype(np.float64)
+    attempts = correct.shape[0]
+
+    if attempts == 0:
+        empty = np.full(len(answer_key), np.nan)
+        return {
+            "attempts": 0,
+            "difficulty": empty,
+            "discrimination": empty,
+            "answered": empty,
+            "option_counts": np.zeros((len(answer_key), len(OPTION_LETTERS)), dtype=np.int64),
+        }
+
+    # the score without the question itself, so a question is not correlated with itself
+    rest_scores = correct.sum(axis=1, keepdims=True) - correct
+    centered_correct = correct - correct.mean(axis=0)
+    centered_rest = rest_scores - rest_scores.mean(axis=0)
+    covariance = (centered_correct * centered_rest).sum(axis=0)
+    spread = np.sqrt((centered_correct**2).sum(axis=0) * (centered_rest**2).sum(axis=0))
+    discrimination = np.divide(
+        covariance, spread, out=np.full(len(answer_key), np.nan), where=spread > 0
+    )
+
+    option_counts = np.stack([(answers == option).sum(axis=0) for option in range(len(OPTION_LETTERS))], axis=1)
+
+    return {
+        "attempts": attempts,
+        "difficulty": correct.mean(axis=0),
+        "discrimination": discrimination,
+        "answered": (answers != UNANSWERED).mean(axis=0),
+        "option_counts": option_counts,
+    }
+
+
+class AttemptStore:
+    """
+    Stores every attempt (one answer vector per player) of every quiz, next to the cache database.
+
+    Answer vectors are stored as raw int8 bytes, so the attempts of a quiz load into one matrix without
+    decoding a row at a time.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(DEFAULT_CACHE_DIR, "attempts.sqlite3")
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS quizzes (
+                    quiz_key TEXT PRIMARY KEY,
+                    topic TEXT NOT NULL,
+                    answer_key BLOB NOT NULL
+                )"""
+            )
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS attempts (
+                    quiz_key TEXT NOT NULL,
+                    player TEXT NOT NULL,
+                    answers BLOB NOT NULL,
+                    created_at REAL NOT NULL
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS attempts_quiz_key ON attempts (quiz_key)")
+
+    def add(self, quiz: Quiz, player: str, answers: np.ndarray) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO quizzes (quiz_key, topic, answer_key) VALUES (?, ?, ?)",
+                (quiz.key, quiz.topic, quiz.answer_key.tobytes()),
+            )
+            self._conn.execute(
+                "INSERT INTO attempts (quiz_key, player, answers, created_at) VALUES (?, ?, ?, ?)",
+                (quiz.key, player, np.asarray(answers, dtype=np.int8).tobytes(), time.time()),
+            )
+
+    def load(self, quiz_key: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Returns the answer key, the players and the (attempts, questions) answer matrix of a quiz."""
+        with self._lock:
+            quiz_row = self._conn.execute(
+                "SELECT answer_key FROM quizzes WHERE quiz_key = ?", (quiz_key,)
+            ).fetchone()
+            rows = self._conn.execute(
+                "SELECT player, answers FROM attempts WHERE quiz_key = ? ORDER BY rowid", (quiz_key,)
+            ).fetchall()
+
+        if quiz_row is None:
+            raise KeyError(quiz_key)
+        answer_key = np.frombuffer(quiz_row[0], dtype=np.int8)
+        players = np.array([player for player, _ in rows], dtype=object)
+        answers = np.frombuffer(b"".join(blob for _, blob in rows), dtype=np.int8).reshape(len(rows), len(answer_key))
+        return answer_key, players, answers
+
+    def quiz_keys(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT quiz_key FROM quizzes ORDER BY rowid")]
+
+    def iter_stats(self) -> Iterator[Dict[str, Any]]:
+        for quiz_key in self.quiz_keys():
+            answer_key, players, answers = self.load(quiz_key)
+            stats = question_stats(answer_key, answers)
+            scores = score_attempts(answer_key, answers)["fractions"]
+            yield {
+                "quiz_key": quiz_key,
+                "mean_score_by_player": {
+                    player: float(scores[players == player].mean()) for player in np.unique(players)
+                },
+                **{key: _to_json(value) for key, value in stats.items()},
+            }
+
+
+def _to_json(value: Any) -> Any:
+    if not isinstance(value, np.ndarray):
+        return value
+    if value.dtype.kind == "f":
+        # NaN is not valid JSON
+        value = np.where(np.isnan(value), None, value)
+    return value.tolist()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Per-question statistics of the stored quiz attempts.")
+    parser.add_argument("--path", help="attempt database (default: attempts.sqlite3 in QUIZ_CACHE_DIR)")
+    args = parser.parse_args(argv)
+
+    for stats in AttemptStore(args.path).iter_stats():
+        print(json.dumps(stats, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,466 @@
+"""
+A headless HTTP API for quiz generation and LLM play, built on asyncio and the standard library.
+
+    python -m backend.service --port 8080 --workers 16 --max-in-flight 5 --queue-size 200 --per-client 8
+
+Work is submitted as jobs and polled:
+
+    POST /quizzes                   {"url": "..."}, or {"topic": "..."} for a quiz from the question bank;
+                                    "source_documents": true keeps the converted page, for /answers/local-rag
+    POST /answers/closed-book       {"quiz": {...}, "mode": "per_question" | "batched"}
+    POST /answers/web-rag           {"quiz": {...}}
+    POST /answers/local-rag         {"quiz": {...}}
+    GET  /jobs/<id>                 status: queued, running, done or failed; the result when done
+    GET  /health
+    GET  /metrics                   Prometheus text format
+
+A POST answers 202 with the job id. When the queue is full, or the client (X-Client-Id header, or its
+address) already has --per-client jobs queued or running, it answers 429 with a Retry-After header.
+A job makes at most --max-in-flight LLM calls at the same time, so the service makes at most
+--workers × --max-in-flight.
+On SIGINT/SIGTERM the service stops accepting jobs (503), finishes the queued and running ones and exits.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import signal
+import sys
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .metrics import metrics
+from .quiz_schema import validate_question
+from .utils import (
+    CLOSED_BOOK_MODES,
+    DEFAULT_MAX_IN_FLIGHT,
+    generate_quiz,
+    generate_topic_quiz,
+    get_closed_book_answers,
+    get_local_rag_answers_and_snippets,
+    get_web_rag_answers_and_snippets,
+    without_source_documents,
+)
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_BYTES = 1024 * 1024
+
+STATUS_TEXT = {
+    200: "OK",
+    202: "Accepted",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    429: "Too Many Requests",
+    503: "Service Unavailable",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+def _required_quiz(body: Dict[str, Any]) -> Dict[str, Any]:
+    quiz = body.get("quiz")
+    if not isinstance(quiz, dict) or "topic" not in quiz or not isinstance(quiz.get("questions"), list):
+        raise HTTPError(400, "'quiz' must be a quiz object with 'topic' and 'questions'")
+    # a broken question would only fail inside the job, as a failed job instead of a bad request
+    for i, question in enumerate(quiz["questions"]):
+        errors = validate_question(question, f"quiz.questions[{i}]")
+        if errors:
+            raise HTTPError(400, f"Invalid question: {errors[0]}")
+    return quiz
+
+
+def _quiz_job(body: Dict[str, Any], max_in_flight: int) -> Callable[[], Any]:
+    # the converted page is only returned on request, it is much larger than the quiz
+    finish = (lambda quiz: quiz) if body.get("source_documents") is True else without_source_documents
+
+    topic = body.get("topic")
+    if topic is not None:
+        if not isinstance(topic, str) or not topic.strip():
+            raise HTTPError(400, "'topic' must be a non-empty string")
+        # at most one LLM call, for the questions the bank is missing
+        return lambda: finish(generate_topic_quiz(topic))
+
+    url = body.get("url")
+    if not isinstance(url, str) or not url.startswith(("http://", "https://")):
+        raise HTTPError(400, "'url' must be an http(s) URL")
+    return lambda: finish(generate_quiz(url, max_in_flight))
+
+
+def _closed_book_job(body: Dict[str, Any], max_in_flight: int) -> Callable[[], Any]:
+    quiz = _required_quiz(body)
+    mode = body.get("mode", "per_question")
+    if mode not in CLOSED_BOOK_MODES:
+        raise HTTPError(400, f"'mode' must be one of {CLOSED_BOOK_MODES}")
+    return lambda: {"answers": get_closed_book_answers(quiz, max_in_flight, mode)}
+
+
+def _web_rag_job(body: Dict[str, Any], max_in_flight: int) -> Callable[[], Any]:
+    quiz = _required_quiz(body)
+
+    def run():
+        answers, snippets = get_web_rag_answers_and_snippets(quiz, max_in_flight)
+        return {"answers": answers, "snippets": snippets}
+
+    return run
+
+
+def _local_rag_job(body: Dict[str, Any], max_in_flight: int) -> Callable[[], Any]:
+    quiz = _required_quiz(body)
+
+    def run():
+        answers, snippets = get_local_rag_answers_and_snippets(quiz, max_in_flight)
+        return {"answers": answers, "snippets": snippets}
+
+    return run
+
+
+# the job kind and the function validating a request body and returning the work to run (with at most
+# `max_in_flight` LLM calls at a time), by path
+JOB_ROUTES = {
+    "/quizzes": ("generate_quiz", _quiz_job),
+    "/answers/closed-book": ("closed_book", _closed_book_job),
+    "/answers/web-rag": ("web_rag", _web_rag_job),
+    "/answers/local-rag": ("local_rag", _local_rag_job),
+}
+
+
+class Job:
+    __slots__ = (
+        "id", "kind", "client", "func", "status", "result", "error", "created_at", "started_at", "finished_at"
+    )
+
+    def __init__(self, kind: str, client: str, func: Callable[[], Any]):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.client = client
+        self.func = func
+        self.status = "queued"
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        job = {"id": self.id, "kind": self.kind, "status": self.status, "created_at": self.created_at}
+        if self.started_at is not None:
+            job["queued_seconds"] = round(self.started_at - self.created_at, 3)
+        if self.finished_at is not None:
+            job["run_seconds"] = round(self.finished_at - self.started_at, 3)
+        if self.status == "done":
+            job["result"] = self.result
+        elif self.status == "failed":
+            job["error"] = self.error
+        return job
+
+
+class QuizService:
+    """
+    Runs jobs from a bounded queue on `workers` threads; the event loop only parses requests and polls,
+    so thousands of connections can wait on a handful of threads doing the blocking LLM calls.
+    """
+
+    def __init__(
+        self,
+        workers: int = 16,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        queue_size: int = 200,
+        per_client: int = 8,
+        job_ttl: float = 3600,
+        max_jobs: int = 10_000,
+        drain_timeout: float = 120,
+    ):
+        self.workers = workers
+        self.max_in_flight = max_in_flight
+        self.queue_size = queue_size
+        self.per_client = per_client
+        self.job_ttl = job_ttl
+        self.max_jobs = max_jobs
+        self.drain_timeout = drain_timeout
+
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self.active_by_client: Dict[str, int] = {}
+        self.running = 0
+        self.rejected = 0
+        self.draining = False
+        # moving average of the job durations, for the Retry-After of a full queue
+        self.mean_job_seconds = 1.0
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="quiz-service")
+        self._worker_tasks = []
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "running": self.running,
+            "clients": len(self.active_by_client),
+            "jobs": len(self.jobs),
+            "rejected": self.rejected,
+            "draining": int(self.draining),
+        }
+
+    # --- jobs ---
+
+    def submit(self, kind: str, client: str, func: Callable[[], Any]) -> Job:
+        if self.draining:
+            raise HTTPError(503, "The service is shutting down")
+        if self.active_by_client.get(client, 0) >= self.per_client:
+            self.rejected += 1
+            metrics.increment("service_rejected", reason="client_limit")
+            raise HTTPError(429, f"At most {self.per_client} jobs per client", {"Retry-After": "1"})
+
+        job = Job(kind, client, func)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            metrics.increment("service_rejected", reason="queue_full")
+            raise HTTPError(429, "The job queue is full", {"Retry-After": str(self._retry_after())}) from None
+
+        self.active_by_client[client] = self.active_by_client.get(client, 0) + 1
+        self.jobs[job.id] = job
+        self._expire_jobs()
+        return job
+
+    def _retry_after(self) -> int:
+        # roughly the time the workers need to get through the queue
+        return max(1, round(self._queue.qsize() / self.workers * self.mean_job_seconds))
+
+    def _expire_jobs(self) -> None:
+        now = time.time()
+        while self.jobs:
+            job = next(iter(self.jobs.values()))
+            finished = job.finished_at is not None
+            expired = finished and now - job.finished_at > self.job_ttl
+            # over max_jobs, the oldest finished jobs are dropped even if they haven't expired
+            if not (expired or (finished and len(self.jobs) > self.max_jobs)):
+                break
+            self.jobs.popitem(last=False)
+
+    async def _worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            self.running += 1
+            metrics.observe("service_queued_seconds", job.started_at - job.created_at, kind=job.kind)
+            try:
+                job.result = await loop.run_in_executor(self._executor, job.func)
+                job.status = "done"
+            except Exception as e:
+                logger.warning("Job %s (%s) failed: %s", job.id, job.kind, e)
+                job.error = f"{type(e).__name__}: {e}"
+                job.status = "failed"
+                metrics.increment("service_failed", kind=job.kind)
+            finally:
+                job.finished_at = time.time()
+                job.func = None
+                self.running -= 1
+                remaining = self.active_by_client.get(job.client, 1) - 1
+                if remaining:
+                    self.active_by_client[job.client] = remaining
+                else:
+                    self.active_by_client.pop(job.client, None)
+                seconds = job.finished_at - job.started_at
+                self.mean_job_seconds = 0.9 * self.mean_job_seconds + 0.1 * seconds
+                metrics.observe("service_job_seconds", seconds, kind=job.kind)
+                self._queue.task_done()
+
+    # --- HTTP ---
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        peer = writer.get_extra_info("peername")
+        address = peer[0] if peer else "unknown"
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except HTTPError as e:
+                    await self._respond(writer, e.status, {"error": str(e)}, e.headers, keep_alive=False)
+                    return
+                if request is None:
+                    return
+
+                method, path, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                client = headers.get("x-client-id") or address
+                try:
+                    status, payload, extra_headers = self.route(method, path, client, body)
+                except HTTPError as e:
+                    status, payload, extra_headers = e.status, {"error": str(e)}, e.headers
+                await self._respond(writer, status, payload, extra_headers, keep_alive)
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            # the client closed the connection between requests
+            return None
+        except asyncio.LimitOverrunError:
+            raise HTTPError(413, "Request headers too large")
+
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise HTTPError(400, "Content-Length must be an integer")
+        if length < 0:
+            raise HTTPError(400, "Content-Length must not be negative")
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, f"The body is larger than {MAX_BODY_BYTES} bytes")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target.split("?", 1)[0], headers, body
+
+    def route(
+        self, method: str, path: str, client: str, body: bytes
+    ) -> Tuple[int, Any, Dict[str, str]]:
+        if path == "/health":
+            return (503 if self.draining else 200), {"status": "draining" if self.draining else "ok", **self.stats()}, {}
+        if path == "/metrics":
+            return 200, metrics.to_prometheus(), {"Content-Type": "text/plain; version=0.0.4"}
+
+        if path.startswith("/jobs/"):
+            if method != "GET":
+                raise HTTPError(405, "Use GET to poll a job")
+            job = self.jobs.get(path[len("/jobs/"):])
+            if job is None:
+                raise HTTPError(404, "Unknown or expired job")
+            return 200, job.to_dict(), {}
+
+        if path in JOB_ROUTES:
+            if method != "POST":
+                raise HTTPError(405, "Use POST to submit a job")
+            kind, build = JOB_ROUTES[path]
+            try:
+                payload = json.loads(body or b"{}")
+            except ValueError:
+                # also a body that is not UTF-8 (UnicodeDecodeError)
+                raise HTTPError(400, "The body must be JSON")
+            if not isinstance(payload, dict):
+                raise HTTPError(400, "The body must be a JSON object")
+            job = self.submit(kind, client, build(payload, self.max_in_flight))
+            return 202, job.to_dict(), {"Location": f"/jobs/{job.id}"}
+
+        raise HTTPError(404, "Not found")
+
+    @staticmethod
+    async def _respond(
+        writer: asyncio.StreamWriter, status: int, payload: Any, headers: Dict[str, str], keep_alive: bool
+    ) -> None:
+        if isinstance(payload, str):
+            data = payload.encode("utf-8")
+        else:
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            headers = {"Content-Type": "application/json", **headers}
+        head = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}"]
+        head += [f"{name}: {value}" for name, value in headers.items()]
+        head += [f"Content-Length: {len(data)}", f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+        await writer.drain()
+
+    # --- lifecycle ---
+
+    async def start(self, host: str, port: int) -> None:
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        # the default stream limit (64 KiB) would reject quizzes with long source documents
+        self._server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_BODY_BYTES)
+        metrics.register_collector("service", self.stats)
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    async def drain(self) -> None:
+        """Stops accepting jobs and waits (up to drain_timeout) for the queued and running ones to finish."""
+        self.draining = True
+        logger.info("Draining: %d queued, %d running", self._queue.qsize(), self.running)
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=self.drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Drain timed out with %d jobs queued and %d running", self._queue.qsize(), self.running)
+
+        self._server.close()
+        try:
+            # idle keep-alive connections are not waited for
+            await asyncio.wait_for(self._server.wait_closed(), timeout=5)
+        except asyncio.TimeoutError:
+            pass
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def serve(self, host: str, port: int) -> None:
+        await self.start(host, port)
+        logger.info("Listening on http://%s:%d", host, self.port)
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await stop.wait()
+        await self.drain()
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="HTTP API for quiz generation and LLM play.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=16, help="jobs running at the same time")
+    parser.add_argument(
+        "--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT, help="LLM calls at the same time per job"
+    )
+    parser.add_argument("--queue-size", type=int, default=200, help="jobs waiting before new ones get a 429")
+    parser.add_argument("--per-client", type=int, default=8, help="queued and running jobs per client")
+    parser.add_argument("--job-ttl", type=float, default=3600, help="seconds a finished job can be polled")
+    parser.add_argument("--drain-timeout", type=float, default=120)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+
+    service = QuizService(
+        workers=args.workers,
+        max_in_flight=args.max_in_flight,
+        queue_size=args.queue_size,
+        per_client=args.per_client,
+        job_ttl=args.job_ttl,
+        drain_timeout=args.drain_timeout,
+    )
+    asyncio.run(service.serve(args.host, args.port))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
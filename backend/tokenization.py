@@ -0,0 +1,29 @@
+import logging
+from functools import lru_cache
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# same tokenizer as gpt-4o-mini
+DEFAULT_ENCODING = "o200k_base"
+
+
+@lru_cache(maxsize=None)
+def get_encoding(name: str = DEFAULT_ENCODING) -> Optional[Any]:
+    # tiktoken is optional, and it downloads the encoding the first time it is used
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        logger.warning("tiktoken encoding '%s' is not available (%s), estimating tokens from characters", name, e)
+        return None
+
+
+@lru_cache(maxsize=100_000)
+def count_tokens(text: str) -> int:
+    encoding = get_encoding()
+    if encoding is None:
+        # roughly 4 characters per token for English and Portuguese text
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
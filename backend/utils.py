@@ -1,59 +1,784 @@
+from .cache import SQLiteCache, hash_key
+from .cassette import CassetteMiss
+from .concurrency import SingleFlight
+from .metrics import metrics, run_pipeline
 from .pipelines import (
-    quiz_generation_pipeline,
-    web_rag_pipeline,
-    closed_book_answer_pipeline,
+    get_document_fetch_pipeline,
+    get_quiz_generation_pipeline,
+    get_question_regeneration_pipeline,
+    get_section_question_pipeline,
+    quiz_generation_template,
+    question_regeneration_template,
+    section_question_template,
+    QUIZ_LONG_DOCUMENT_TOKENS,
+    QUIZ_MAX_SECTIONS,
+    QUIZ_QUESTION_COUNT,
+    QUIZ_QUESTIONS_PER_SECTION,
+    QUIZ_SECTION_TOKENS,
+    get_streaming_quiz_generation_pipeline,
+    stream_to,
+    get_web_rag_pipeline,
+    get_local_rag_pipeline,
+    get_closed_book_answer_pipeline,
+    get_batched_closed_book_answer_pipeline,
 )
-from typing import Dict, Any, List, Tuple
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, Any, Callable, List, Optional, Sequence, Tuple
+import logging
+import os
 import random
+import threading
 
+if TYPE_CHECKING:
+    from haystack import Document
 
-def generate_quiz(url: str) -> Dict[str, Any]:
-    return quiz_generation_pipeline.run({"link_content_fetcher": {"urls": [url]}})[
-        "quiz_parser"
-    ]["quiz"]
 
+logger = logging.getLogger(__name__)
 
-def get_closed_book_answers(quiz: Dict[str, Any]) -> List[str]:
+OPTIONS = ["a", "b", "c", "d"]
+
+# "per_question" sends one request per question, "batched" answers the whole quiz in a single request
+CLOSED_BOOK_MODES = ["per_question", "batched"]
+
+# how many LLM calls one request makes at the same time: the questions during "Deixar a LLM Jogar",
+# the sections of a long page during quiz generation, which all run in a single round
+DEFAULT_MAX_IN_FLIGHT = max(QUIZ_QUESTION_COUNT, QUIZ_MAX_SECTIONS)
+
+# how many times the invalid questions of a generated quiz are generated again before they are dropped
+QUIZ_REGENERATION_ATTEMPTS = int(os.getenv("QUIZ_REGENERATION_ATTEMPTS", 2))
+
+
+# concurrent identical requests (a link shared with many users at once) are computed once and share the result
+_single_flight = SingleFlight()
+metrics.register_collector("single_flight", _single_flight.stats)
+
+
+def _coalesce(name: str, key: str, func: Callable[[], Any]) -> Tuple[Any, bool]:
+    """Runs `func` through the process-wide single-flight; returns its result and whether this call ran it."""
+    ran = False
+
+    def run():
+        nonlocal ran
+        ran = True
+        return func()
+
+    result = _single_flight.do(hash_key(name, key), run)
+    if not ran:
+        metrics.increment("coalesced_calls", function=name)
+    return result, ran
+
+
+def _quiz_content_key(quiz: Dict[str, Any]) -> str:
+    return hash_key(quiz["topic"], quiz["questions"])
+
+
+@lru_cache(maxsize=None)
+def get_quiz_cache() -> SQLiteCache:
+    # generated quizzes are cached on disk, so that popular URLs skip the LLM call
+    quiz_cache = SQLiteCache(
+        "quizzes",
+        ttl=float(os.getenv("QUIZ_CACHE_TTL", 7 * 24 * 3600)),
+        max_bytes=int(float(os.getenv("QUIZ_CACHE_MAX_MB", 100)) * 1024 * 1024),
+    )
+    metrics.register_collector("quiz_cache", quiz_cache.stats)
+    return quiz_cache
+
+
+@lru_cache(maxsize=None)
+def get_attempt_store():
+    # imported here, so that importing backend.utils (the service, the bulk CLI) doesn't load NumPy
+    from .scoring import AttemptStore
+
+    return AttemptStore()
+
+
+@lru_cache(maxsize=None)
+def get_question_bank():
+    """The process-wide question bank, or None when QUIZ_QUESTION_BANK=0 disables it."""
+    if os.getenv("QUIZ_QUESTION_BANK", "1") == "0":
+        return None
+
+    from .question_bank import QuestionBank
+
+    question_bank = QuestionBank(
+        duplicate_similarity=float(os.getenv("QUIZ_QUESTION_BANK_DUPLICATE_SIMILARITY", 0.7)),
+        max_age=float(os.getenv("QUIZ_QUESTION_BANK_MAX_AGE", 7 * 24 * 3600)),
+        page_similarity=float(os.getenv("QUIZ_QUESTION_BANK_PAGE_SIMILARITY", 0.9)),
+    )
+    metrics.register_collector("question_bank", question_bank.stats)
+    return question_bank
+
+
+def run_concurrently(
+    func: Callable[[Any], Any],
+    items: Sequence[Any],
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    on_error: Optional[Callable[[Any, Exception], Any]] = None,
+) -> List[Any]:
+    """
+    Applies `func` to every item using a bounded thread pool and returns the results in the order of `items`.
+
+    If `on_error` is given, an exception raised for one item is replaced by `on_error(item, exception)`,
+    so a single failure does not discard the results of the other items. A CassetteMiss is always raised:
+    a replay without the recorded reply must not be scored as a failed call.
+    """
+
+    def call(item):
+        try:
+            return func(item)
+        except CassetteMiss:
+            raise
+        except Exception as e:
+            if on_error is None:
+                raise
+            return on_error(item, e)
+
+    if max_in_flight <= 1 or len(items) <= 1:
+        return [call(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(max_in_flight, len(items))) as executor:
+        return list(executor.map(call, items))
+
+
+def _normalize_answer(answer: str) -> str:
+    # in some rare cases, the model answers "I don't know" or something similar
+    if answer not in OPTIONS:
+        answer = random.choice(OPTIONS)
+    return answer
+
+
+def fetch_documents(url: str) -> List["Document"]:
+    return run_pipeline(
+        "document_fetch", get_document_fetch_pipeline(), {"document_fetcher": {"urls": [url]}}
+    )["document_fetcher"]["documents"]
+
+
+def quiz_cache_key(url: str, documents: List["Document"]) -> str:
+    # a changed page, prompt or model configuration produces a different key, so stale entries are never served
+    return hash_key(url, hash_key([doc.content for doc in documents]), quiz_settings_key())
+
+
+def quiz_settings_key() -> str:
+    """The key of everything a quiz is generated with besides the page: the prompts and the model configuration."""
+    pipeline = get_quiz_generation_pipeline()
+    generator = pipeline.get_component("generator")
+    return hash_key(
+        hash_key(quiz_generation_template),
+        hash_key(question_regeneration_template),
+        hash_key(section_question_template),
+        (QUIZ_LONG_DOCUMENT_TOKENS, QUIZ_SECTION_TOKENS, QUIZ_MAX_SECTIONS, QUIZ_QUESTIONS_PER_SECTION),
+        pipeline.get_component("passage_selector").token_budget,
+        generator.model,
+        generator.generation_kwargs,
+    )
+
+
+def with_source_documents(quiz: Dict[str, Any], documents: List["Document"]) -> Dict[str, Any]:
+    # the converted page is kept with the quiz, so the local RAG mode can answer from it without fetching again
+    source_documents = [{"content": doc.content, "url": doc.meta.get("url")} for doc in documents]
+    return {**quiz, "source_documents": source_documents}
+
+
+def without_source_documents(quiz: Dict[str, Any]) -> Dict[str, Any]:
+    # for quizzes leaving the process (files, API responses), where the converted page is only dead weight
+    return {key: value for key, value in quiz.items() if key != "source_documents"}
+
+
+def generate_quiz(url: str, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT) -> Dict[str, Any]:
+    from .warm_pool import get_warm_quiz
+
+    # URLs kept warm by the background pool are served without fetching the page
+    quiz = get_warm_quiz(url)
+    if quiz is not None:
+        return quiz
+
+    quiz, _ = _coalesce("generate_quiz", url, lambda: _generate_quiz(url, max_in_flight))
+    return quiz
+
+
+def _generate_quiz(url: str, max_in_flight: int) -> Dict[str, Any]:
+    quiz, _ = generate_quiz_from_documents(url, fetch_documents(url), max_in_flight)
+    return quiz
+
+
+def generate_quiz_from_documents(
+    url: str, documents: List["Document"], max_in_flight: int = DEFAULT_MAX_IN_FLIGHT
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Returns the quiz for already fetched documents and the token usage of the LLM calls (empty without any).
+    At most `max_in_flight` LLM calls run at the same time; callers that bound their own concurrency pass 1.
+    """
+    key = quiz_cache_key(url, documents)
+    quiz, usage = find_quiz(key, url, documents)
+    if quiz is not None:
+        return with_source_documents(quiz, documents), usage
+
+    if is_long_document(documents):
+        quiz, usage = generate_long_document_quiz(url, documents, max_in_flight)
+        store_quiz(key, url, documents, quiz)
+        return with_source_documents(quiz, documents), usage
+
+    result = run_pipeline(
+        "quiz_generation",
+        get_quiz_generation_pipeline(),
+        {"passage_selector": {"documents": documents}},
+        include_outputs_from=["generator"],
+    )
+    usage = result["generator"]["meta"][0].get("usage", {})
+    quiz, regeneration_usage = replace_invalid_questions(
+        result["quiz_validator"]["quiz"], result["quiz_validator"]["invalid_questions"], documents
+    )
+    store_quiz(key, url, documents, quiz)
+
+    return with_source_documents(quiz, documents), _add_usage(usage, regeneration_usage)
+
+
+def find_quiz(
+    key: str, url: str, documents: List["Document"]
+) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+    """
+    The quiz of a page that doesn't need a full generation, and the token usage of getting it: the cached
+    quiz, else one assembled from the question bank. Returns None when the quiz has to be generated.
+    """
+    quiz = get_quiz_cache().get(key)
+    if quiz is not None:
+        return quiz, {}
+
+    quiz, usage = quiz_from_question_bank(key, url, documents)
+    if quiz is not None:
+        get_quiz_cache().set(key, quiz)
+    return quiz, usage
+
+
+def store_quiz(key: str, url: str, documents: List["Document"], quiz: Dict[str, Any]) -> None:
+    """Caches a generated quiz and adds its questions to the question bank."""
+    get_quiz_cache().set(key, quiz)
+    question_bank = get_question_bank()
+    if question_bank is not None:
+        question_bank.add(quiz, **bank_page(url, key, documents))
+
+
+def bank_page(url: str, key: str, documents: List["Document"]) -> Dict[str, Any]:
+    """
+    A version of a page as the question bank knows it: `key` from quiz_cache_key, the exact generation
+    settings, and the content, which is compared by similarity with the other versions of the page.
+    """
+    return {
+        "source": url,
+        "version": key,
+        "settings": quiz_settings_key(),
+        "content": [doc.content or "" for doc in documents],
+    }
+
+
+def quiz_from_question_bank(
+    key: str, url: str, documents: List["Document"]
+) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Assembles the quiz of a page from the fresh questions the bank has for it: those of this version of the
+    page and of its similar versions, generated with the same prompts and model, so that a slightly edited
+    page reuses its questions but a rewritten page, or another prompt or model, does not. Returns None when
+    the bank has no question for the page.
+    """
+    question_bank = get_question_bank()
+    if question_bank is None:
+        return None, {}
+
+    page = bank_page(url, key, documents)
+    with metrics.timer("question_bank_assemble_seconds"):
+        entries = question_bank.assemble(**page, count=QUIZ_QUESTION_COUNT)
+    if not entries:
+        return None, {}
+    question_bank.link([entry["id"] for entry in entries], **page)
+    return _complete_bank_quiz(question_bank, entries, page, documents)
+
+
+def generate_topic_quiz(topic: str) -> Dict[str, Any]:
+    """
+    A quiz about `topic` assembled from the question bank, from any source. When the bank has too few
+    questions, the missing ones are generated from the current page of the best matching question.
+    """
+    question_bank = get_question_bank()
+    if question_bank is None:
+        raise ValueError("The question bank is disabled (QUIZ_QUESTION_BANK=0)")
+
+    with metrics.timer("question_bank_assemble_seconds"):
+        entries = question_bank.assemble(topic=topic, count=QUIZ_QUESTION_COUNT)
+    if not entries:
+        raise ValueError(f"The question bank has no questions about {topic!r}")
+
+    sources = question_bank.sources(entries[0]["id"])
+    if len(entries) == QUIZ_QUESTION_COUNT or not sources:
+        quiz, _ = _complete_bank_quiz(question_bank, entries, None, None)
+        return quiz
+
+    documents = fetch_documents(sources[0])
+    page = bank_page(sources[0], quiz_cache_key(sources[0], documents), documents)
+    quiz, _ = _complete_bank_quiz(question_bank, entries, page, documents)
+    return with_source_documents(quiz, documents)
+
+
+def _complete_bank_quiz(
+    question_bank: Any,
+    entries: List[Dict[str, Any]],
+    page: Optional[Dict[str, Any]],
+    documents: Optional[List["Document"]],
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Builds a quiz from bank entries and, given a page (see bank_page) and its documents, generates only the
+    questions that are missing (with the bank's questions in the prompt, so they are not repeated) and adds
+    them to the bank for that page. Returns the quiz and the token usage.
+    """
+    from .question_bank import most_common_topic
+
+    quiz = {"topic": most_common_topic(entries), "questions": [entry["question"] for entry in entries]}
+    missing = QUIZ_QUESTION_COUNT - len(entries)
+    metrics.increment("question_bank_quizzes", complete=str(missing == 0).lower())
+    if missing == 0 or documents is None:
+        return quiz, {}
+
+    quiz["questions"] += [None] * missing
+    quiz, usage = replace_invalid_questions(quiz, list(range(len(entries), QUIZ_QUESTION_COUNT)), documents)
+    question_bank.add({**quiz, "questions": quiz["questions"][len(entries) :]}, **page)
+    return quiz, usage
+
+
+def is_long_document(documents: List["Document"]) -> bool:
+    from .custom_components import split_passages
+    from .tokenization import count_tokens
+
+    # measured on the passages PassageSelector chooses from, not on the boilerplate around them
+    tokens = sum(count_tokens(passage) for doc in documents for passage in split_passages(doc.content or ""))
+    return tokens > QUIZ_LONG_DOCUMENT_TOKENS
+
+
+def generate_long_document_quiz(
+    url: str, documents: List["Document"], max_in_flight: int = DEFAULT_MAX_IN_FLIGHT
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Map-reduce generation for long pages: every section gets a small prompt for a few candidate questions,
+    `max_in_flight` sections at a time, and QuestionSelector picks a diverse, easy-to-hard set of
+    QUIZ_QUESTION_COUNT questions from the candidates without another LLM call. With the default
+    `max_in_flight`, all QUIZ_MAX_SECTIONS sections are in flight at once and the latency is about that of
+    one section prompt; a smaller bound takes ceil(sections / max_in_flight) rounds.
+
+    The candidates that were not selected go to the question bank, for the next quiz of the page.
+    """
+    from .custom_components import QuestionSelector, SectionSplitter
+    from .quiz_schema import validate_question
+
+    sections = SectionSplitter(section_tokens=QUIZ_SECTION_TOKENS, max_sections=QUIZ_MAX_SECTIONS).run(
+        documents=documents
+    )["sections"]
+    section_question_pipeline = get_section_question_pipeline()
+
+    def generate_for_section(section: "Document") -> Tuple[Optional[str], List[Dict[str, Any]], Dict[str, Any]]:
+        result = run_pipeline(
+            "section_question_generation",
+            section_question_pipeline,
+            {"prompt_builder": {"section": section, "count": QUIZ_QUESTIONS_PER_SECTION}},
+            include_outputs_from=["generator"],
+        )
+        reply = result["quiz_parser"]["quiz"]
+        usage = result["generator"]["meta"][0].get("usage", {})
+        if not isinstance(reply, dict) or not isinstance(reply.get("questions"), list):
+            return None, [], usage
+
+        candidates = []
+        for question in reply["questions"]:
+            if not isinstance(question, dict):
+                continue
+            difficulty = question.get("difficulty")
+            question = {key: value for key, value in question.items() if key != "difficulty"}
+            if validate_question(question):
+                continue
+            candidates.append(
+                {
+                    "section": section.meta["section"],
+                    "difficulty": difficulty if difficulty in (1, 2, 3) else 2,
+                    "question": question,
+                }
+            )
+        topic = reply.get("topic") if isinstance(reply.get("topic"), str) else None
+        return topic, candidates, usage
+
+    def on_error(section: "Document", error: Exception) -> Tuple[None, List, Dict]:
+        logger.warning("Question generation failed for section %d: %s", section.meta["section"], error)
+        return None, [], {}
+
+    # the sections run concurrently, but within the caller's bound on LLM calls
+    results = run_concurrently(generate_for_section, sections, max_in_flight, on_error)
+
+    usage: Dict[str, Any] = {}
+    candidates: List[Dict[str, Any]] = []
+    for _, section_candidates, section_usage in results:
+        candidates.extend(section_candidates)
+        usage = _add_usage(usage, section_usage)
+
+    # the first section is the introduction, which describes the page best
+    topic = next((topic for topic, _, _ in results if topic), None)
+    if topic is None:
+        raise ValueError("No section of the page produced a quiz")
+
+    questions = QuestionSelector(count=QUIZ_QUESTION_COUNT).run(candidates=candidates)["questions"]
+    metrics.observe("section_candidates", len(candidates))
+
+    question_bank = get_question_bank()
+    if question_bank is not None:
+        selected = {id(question) for question in questions}
+        unselected = [candidate["question"] for candidate in candidates if id(candidate["question"]) not in selected]
+        question_bank.add(
+            {"topic": topic, "questions": unselected}, **bank_page(url, quiz_cache_key(url, documents), documents)
+        )
+
+    quiz = {"topic": topic, "questions": questions}
+    missing = QUIZ_QUESTION_COUNT - len(questions)
+    if missing > 0:
+        # too few valid candidates: the missing questions are generated like invalid ones
+        quiz["questions"] = questions + [None] * missing
+        quiz, regeneration_usage = replace_invalid_questions(
+            quiz, list(range(len(questions), QUIZ_QUESTION_COUNT)), documents
+        )
+        usage = _add_usage(usage, regeneration_usage)
+
+    return quiz, usage
+
+
+def _add_usage(usage: Dict[str, Any], other: Dict[str, Any]) -> Dict[str, Any]:
+    total = dict(usage)
+    for key, value in other.items():
+        if isinstance(value, (int, float)):
+            total[key] = total.get(key, 0) + value
+    return total
+
+
+def replace_invalid_questions(
+    quiz: Dict[str, Any], invalid_questions: List[int], documents: List["Document"]
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Generates replacements for the invalid questions of a quiz, keeping the valid ones and their positions.
+
+    Returns the quiz and the token usage of the extra LLM calls. Questions that are still invalid after
+    QUIZ_REGENERATION_ATTEMPTS are dropped, so the quiz can have fewer questions, but never a broken one.
+    """
+    if not invalid_questions:
+        return quiz, {}
+
+    questions = list(quiz["questions"])
+    invalid = list(invalid_questions)
+    usage: Dict[str, Any] = {}
+
+    for attempt in range(QUIZ_REGENERATION_ATTEMPTS):
+        logger.info(
+            "Generating %d invalid questions again (attempt %d of %d)", len(invalid), attempt + 1, QUIZ_REGENERATION_ATTEMPTS
+        )
+        metrics.increment("regenerated_questions", len(invalid))
+        valid = [question for i, question in enumerate(questions) if i not in invalid]
+        try:
+            result = run_pipeline(
+                "question_regeneration",
+                get_question_regeneration_pipeline(),
+                {
+                    "passage_selector": {"documents": documents},
+                    "prompt_builder": {"topic": quiz["topic"], "questions": valid, "count": len(invalid)},
+                },
+                include_outputs_from=["generator"],
+            )
+        except CassetteMiss:
+            raise
+        except Exception as e:
+            logger.warning("Question regeneration failed: %s", e)
+            continue
+
+        usage = _add_usage(usage, result["generator"]["meta"][0].get("usage", {}))
+        replacements = [
+            question
+            for i, question in enumerate(result["quiz_validator"]["quiz"]["questions"])
+            if i not in result["quiz_validator"]["invalid_questions"]
+        ]
+        # the replacements take the places of the invalid questions, in order, so the difficulty ramp is kept
+        for i, replacement in zip(list(invalid), replacements):
+            questions[i] = replacement
+            invalid.remove(i)
+        if not invalid:
+            break
+
+    if invalid:
+        logger.warning("Dropping %d questions that are still invalid", len(invalid))
+        metrics.increment("dropped_questions", len(invalid))
+        questions = [question for i, question in enumerate(questions) if i not in invalid]
+
+    return {**quiz, "questions": questions}, usage
+
+
+def generate_quiz_streaming(url: str, on_question: Callable[[int, Dict[str, Any]], None]) -> Dict[str, Any]:
+    """
+    Like generate_quiz, but calls `on_question(index, question)` for every question as soon as it has been generated.
+
+    The returned quiz is parsed from the complete reply, exactly as in generate_quiz. Long pages are not
+    split into sections here: their questions would only be known once every section is done, so the
+    first question would come no sooner than the whole quiz.
+    """
+    from .warm_pool import get_warm_quiz
+
+    quiz = get_warm_quiz(url)
+    if quiz is None:
+        # shares the in-flight generation with generate_quiz: a caller that waited for another one
+        # gets the questions of the finished quiz
+        quiz, ran = _coalesce("generate_quiz", url, lambda: _generate_quiz_streaming(url, on_question))
+        if ran:
+            return quiz
+
+    return _emit_questions(quiz, on_question)
+
+
+def _emit_questions(quiz: Dict[str, Any], on_question: Callable[[int, Dict[str, Any]], None]) -> Dict[str, Any]:
+    # for quizzes that were not streamed: all their questions are known at once
+    for i, question in enumerate(quiz["questions"]):
+        on_question(i, question)
+    return quiz
+
+
+def _generate_quiz_streaming(url: str, on_question: Callable[[int, Dict[str, Any]], None]) -> Dict[str, Any]:
+    documents = fetch_documents(url)
+
+    key = quiz_cache_key(url, documents)
+    quiz, _ = find_quiz(key, url, documents)
+    if quiz is not None:
+        return _emit_questions(with_source_documents(quiz, documents), on_question)
+
+    from .custom_components import IncrementalQuizParser
+
+    from .quiz_schema import validate_question
+
+    parser = IncrementalQuizParser()
+    emitted = []
+
+    def on_text(text: str) -> None:
+        for question in parser.feed(text):
+            # invalid questions are not previewed, they are replaced once the reply is complete
+            if validate_question(question):
+                continue
+            on_question(len(emitted), question)
+            emitted.append(question)
+
+    with stream_to(on_text):
+        result = run_pipeline(
+            "streaming_quiz_generation",
+            get_streaming_quiz_generation_pipeline(),
+            {"passage_selector": {"documents": documents}},
+        )
+    quiz, _ = replace_invalid_questions(
+        result["quiz_validator"]["quiz"], result["quiz_validator"]["invalid_questions"], documents
+    )
+    store_quiz(key, url, documents, quiz)
+
+    return with_source_documents(quiz, documents)
+
+
+def get_closed_book_answers(
+    quiz: Dict[str, Any],
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    mode: str = "per_question",
+) -> List[Optional[str]]:
+    if mode not in CLOSED_BOOK_MODES:
+        raise ValueError(f"Unknown closed-book mode '{mode}', expected one of {CLOSED_BOOK_MODES}")
+
+    answers, _ = _coalesce(
+        "get_closed_book_answers",
+        hash_key(_quiz_content_key(quiz), mode),
+        lambda: _get_closed_book_answers(quiz, max_in_flight, mode),
+    )
+    return list(answers)
+
+
+def _get_closed_book_answers(quiz: Dict[str, Any], max_in_flight: int, mode: str) -> List[Optional[str]]:
     topic = quiz["topic"]
     questions = quiz["questions"]
+    closed_book_answer_pipeline = get_closed_book_answer_pipeline()
 
-    answers = []
-
-    for question in questions:
-        answer = closed_book_answer_pipeline.run(
-            {"prompt_builder": {"topic": topic, "question": question}}
+    def answer_question(question: Dict[str, Any]) -> str:
+        answer = run_pipeline(
+            "closed_book_answer",
+            closed_book_answer_pipeline,
+            {"prompt_builder": {"topic": topic, "question": question}},
         )["generator"]["replies"][0]
-        # in some rare cases, the model answers "I don't know" or something similar
-        if answer not in ["a", "b", "c", "d"]:
-            answer = random.choice(["a", "b", "c", "d"])
-        answers.append(answer)
+        return _normalize_answer(answer)
+
+    def on_error(question: Dict[str, Any], error: Exception) -> Optional[str]:
+        # a failed question (timeout, API error) is left unanswered, so it is not scored as a guess
+        logger.warning("Closed-book answer failed for %r: %s", question["question"], error)
+        return None
+
+    if mode == "per_question":
+        return run_concurrently(answer_question, questions, max_in_flight, on_error)
+
+    answers = _get_batched_closed_book_answers(topic, questions)
+
+    # only the entries that are missing from the answer vector are asked again, one question at a time
+    missing = [i for i, answer in enumerate(answers) if answer is None]
+    if missing:
+        logger.info("Batched closed-book reply is missing %d of %d answers", len(missing), len(questions))
+        retried = run_concurrently(
+            answer_question, [questions[i] for i in missing], max_in_flight, on_error
+        )
+        for i, answer in zip(missing, retried):
+            answers[i] = answer
 
     return answers
 
 
-def get_web_rag_answers_and_snippets(quiz: Dict[str, Any]) -> Tuple:
+def _get_batched_closed_book_answers(
+    topic: str, questions: List[Dict[str, Any]]
+) -> List[Optional[str]]:
+    try:
+        answers = run_pipeline(
+            "batched_closed_book_answer",
+            get_batched_closed_book_answer_pipeline(),
+            {"prompt_builder": {"topic": topic, "questions": questions}},
+        )["answer_parser"]["answers"]
+    except CassetteMiss:
+        raise
+    except Exception as e:
+        logger.warning("Batched closed-book answer failed: %s", e)
+        answers = []
+
+    if len(answers) != len(questions):
+        logger.info(
+            "Batched closed-book reply has %d answers for %d questions", len(answers), len(questions)
+        )
+
+    # a vector of the wrong length is aligned by position: extra entries are dropped, missing ones are None
+    return (answers + [None] * len(questions))[: len(questions)]
+
+
+def get_web_rag_answers_and_snippets(
+    quiz: Dict[str, Any], max_in_flight: int = DEFAULT_MAX_IN_FLIGHT
+) -> Tuple:
+    (answers, snippets), _ = _coalesce(
+        "get_web_rag_answers_and_snippets",
+        _quiz_content_key(quiz),
+        lambda: _get_web_rag_answers_and_snippets(quiz, max_in_flight),
+    )
+    return list(answers), list(snippets)
+
+
+def _get_web_rag_answers_and_snippets(quiz: Dict[str, Any], max_in_flight: int) -> Tuple:
     topic = quiz["topic"]
     questions = quiz["questions"]
+    web_rag_pipeline = get_web_rag_pipeline()
 
-    answers, snippets = [], []
-
-    for question in questions:
-        result = web_rag_pipeline.run(
-            data={
+    def answer_question(question: Dict[str, Any]) -> Tuple[str, List[str]]:
+        result = run_pipeline(
+            "web_rag",
+            web_rag_pipeline,
+            {
                 "websearch": {"query": question["question"]},
                 "prompt_builder": {"topic": topic, "question": question},
             },
             include_outputs_from=["websearch", "generator"],
         )
 
-        print(result)
-
-        answer = result["generator"]["replies"][0]
-        # in some rare cases, the model answers "I don't know" or something similar
-        if answer not in ["a", "b", "c", "d"]:
-            answer = random.choice(["a", "b", "c", "d"])
+        answer = _normalize_answer(result["generator"]["replies"][0])
         snippets_ = [doc.content for doc in result["websearch"]["documents"]]
-        answers.append(answer)
-        snippets.append(snippets_)
+        return answer, snippets_
+
+    def on_error(question: Dict[str, Any], error: Exception) -> Tuple[Optional[str], List[str]]:
+        logger.warning("Web RAG answer failed for %r: %s", question["question"], error)
+        return None, []
+
+    results = run_concurrently(answer_question, questions, max_in_flight, on_error)
+
+    answers = [answer for answer, _ in results]
+    snippets = [snippets_ for _, snippets_ in results]
+
+    return answers, snippets
+
+
+# the BM25 index of a quiz's source page is built once and reused while the quiz is being played
+_local_document_stores: "OrderedDict[str, Any]" = OrderedDict()
+_local_document_stores_lock = threading.Lock()
+MAX_LOCAL_DOCUMENT_STORES = 32
+
+
+def get_local_document_store(quiz: Dict[str, Any]):
+    from haystack import Document
+    from haystack.components.preprocessors import DocumentSplitter
+    from haystack.document_stores.in_memory import InMemoryDocumentStore
+
+    source_documents = quiz.get("source_documents")
+    if not source_documents:
+        raise ValueError("The quiz has no source documents, generate it again to use the local RAG mode")
+
+    key = hash_key([doc["content"] for doc in source_documents])
+    with _local_document_stores_lock:
+        if key in _local_document_stores:
+            _local_document_stores.move_to_end(key)
+            return _local_document_stores[key]
+
+    documents = [
+        Document(content=doc["content"], meta={"url": doc.get("url")})
+        for doc in source_documents
+        if doc.get("content")
+    ]
+    passages = DocumentSplitter(split_by="word", split_length=100, split_overlap=20).run(
+        documents=documents
+    )["documents"]
+
+    document_store = InMemoryDocumentStore()
+    document_store.write_documents(passages)
+
+    with _local_document_stores_lock:
+        _local_document_stores[key] = document_store
+        while len(_local_document_stores) > MAX_LOCAL_DOCUMENT_STORES:
+            _local_document_stores.popitem(last=False)
+
+    return document_store
+
+
+def get_local_rag_answers_and_snippets(
+    quiz: Dict[str, Any], max_in_flight: int = DEFAULT_MAX_IN_FLIGHT, top_k: int = 3
+) -> Tuple:
+    (answers, snippets), _ = _coalesce(
+        "get_local_rag_answers_and_snippets",
+        hash_key(_quiz_content_key(quiz), top_k),
+        lambda: _get_local_rag_answers_and_snippets(quiz, max_in_flight, top_k),
+    )
+    return list(answers), list(snippets)
+
+
+def _get_local_rag_answers_and_snippets(quiz: Dict[str, Any], max_in_flight: int, top_k: int) -> Tuple:
+    from haystack.components.retrievers.in_memory import InMemoryBM25Retriever
+
+    topic = quiz["topic"]
+    questions = quiz["questions"]
+    retriever = InMemoryBM25Retriever(document_store=get_local_document_store(quiz), top_k=top_k)
+    local_rag_pipeline = get_local_rag_pipeline()
+
+    def answer_question(question: Dict[str, Any]) -> Tuple[str, List[str]]:
+        # the options are part of the query, so passages that discriminate between them rank higher
+        query = " ".join([question["question"], *question.get("options", [])])
+        with metrics.timer("component_seconds", pipeline="local_rag", component="retriever"):
+            documents = retriever.run(query=query)["documents"]
+
+        result = run_pipeline(
+            "local_rag",
+            local_rag_pipeline,
+            {"prompt_builder": {"topic": topic, "question": question, "documents": documents}},
+        )
+
+        answer = _normalize_answer(result["generator"]["replies"][0])
+        return answer, [doc.content for doc in documents]
+
+    def on_error(question: Dict[str, Any], error: Exception) -> Tuple[Optional[str], List[str]]:
+        logger.warning("Local RAG answer failed for %r: %s", question["question"], error)
+        return None, []
+
+    results = run_concurrently(answer_question, questions, max_in_flight, on_error)
+
+    answers = [answer for answer, _ in results]
+    snippets = [snippets_ for _, snippets_ in results]
 
     return answers, snippets
@@ -0,0 +1,200 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+from .cache import SQLiteCache
+from .metrics import metrics
+from .utils import fetch_documents, generate_quiz_from_documents
+
+logger = logging.getLogger(__name__)
+
+
+class WarmPool:
+    """
+    Keeps ready-made quizzes for a set of URLs: the configured ones (the app's examples) plus the URLs
+    requested most often in the last `trending_window` seconds.
+
+    A background thread refreshes every URL once per `refresh_seconds`, with at most `concurrency`
+    refreshes at a time and at most `tokens_per_hour` LLM tokens per hour. Refreshing an unchanged page
+    is cheap: the page is fetched with a conditional GET and the quiz comes from the quiz cache.
+    The quizzes are stored by URL, so a request for a warm URL is answered without fetching the page;
+    an entry older than `max_age` is not served.
+    """
+
+    def __init__(
+        self,
+        urls: Iterable[str],
+        refresh_seconds: float = 6 * 3600,
+        max_age: Optional[float] = None,
+        concurrency: int = 2,
+        tokens_per_hour: int = 200_000,
+        trending: int = 10,
+        trending_window: float = 24 * 3600,
+        cache: Optional[SQLiteCache] = None,
+    ):
+        self.urls = list(dict.fromkeys(urls))
+        self.refresh_seconds = refresh_seconds
+        self.max_age = max_age if max_age is not None else 2 * refresh_seconds
+        self.concurrency = concurrency
+        self.tokens_per_hour = tokens_per_hour
+        self.trending = trending
+        self.trending_window = trending_window
+        self.cache = cache or SQLiteCache("warm_quizzes", ttl=self.max_age)
+
+        self.started_at = time.time()
+        self.refreshed_at: Dict[str, float] = {}
+        self._next_refresh: Dict[str, float] = {}
+        self.requests = 0
+        self.hits = 0
+        self.refreshes = 0
+        self.failures = 0
+        self.budget_skips = 0
+
+        self._recent_requests: Deque[Tuple[float, str]] = deque()
+        self._spent_tokens: Deque[Tuple[float, int]] = deque()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        entry = self.cache.get(url)
+        return entry["quiz"] if entry is not None else None
+
+    def record_request(self, url: str, hit: bool) -> None:
+        now = time.time()
+        with self._lock:
+            self._recent_requests.append((now, url))
+            while self._recent_requests and now - self._recent_requests[0][0] > self.trending_window:
+                self._recent_requests.popleft()
+            self.requests += 1
+            self.hits += hit
+
+    def targets(self) -> List[str]:
+        with self._lock:
+            counts = Counter(url for _, url in self._recent_requests)
+        trending = [url for url, _ in counts.most_common(self.trending)]
+        return list(dict.fromkeys(self.urls + trending))
+
+    def _spent_last_hour(self, now: float) -> int:
+        while self._spent_tokens and now - self._spent_tokens[0][0] > 3600:
+            self._spent_tokens.popleft()
+        return sum(tokens for _, tokens in self._spent_tokens)
+
+    def refresh(self, url: str) -> None:
+        with self._lock:
+            if self._spent_last_hour(time.time()) >= self.tokens_per_hour:
+                self.budget_skips += 1
+                logger.info("Warm pool token budget spent, not refreshing %s", url)
+                return
+
+        try:
+            with metrics.timer("warm_pool_refresh_seconds"):
+                documents = fetch_documents(url)
+                # one LLM call at a time per refresh, so `concurrency` bounds the LLM calls
+                quiz, usage = generate_quiz_from_documents(url, documents, max_in_flight=1)
+        except Exception as e:
+            logger.warning("Warm pool failed to refresh %s: %s", url, e)
+            with self._lock:
+                self.failures += 1
+                # a failing URL is tried again sooner than a refresh, but not at every check
+                self._next_refresh[url] = time.time() + min(self.refresh_seconds, 600)
+            return
+
+        now = time.time()
+        self.cache.set(url, {"quiz": quiz, "refreshed_at": now})
+        with self._lock:
+            self.refreshed_at[url] = now
+            self._next_refresh[url] = now + self.refresh_seconds
+            self.refreshes += 1
+            self._spent_tokens.append((now, usage.get("total_tokens", 0)))
+
+    def due(self) -> List[str]:
+        now = time.time()
+        targets = self.targets()
+        with self._lock:
+            return [url for url in targets if self._next_refresh.get(url, 0) <= now]
+
+    def run_once(self) -> None:
+        due = self.due()
+        if not due:
+            return
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            list(executor.map(self.refresh, due))
+
+    def start(self, check_seconds: float = 60.0) -> "WarmPool":
+        def loop():
+            while not self._stop.is_set():
+                try:
+                    self.run_once()
+                except Exception:
+                    logger.exception("Warm pool refresh failed")
+                self._stop.wait(min(check_seconds, self.refresh_seconds))
+
+        self._thread = threading.Thread(target=loop, name="quiz-warm-pool", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        # how long ago each target was last refreshed (since the pool started, if it never was)
+        targets = self.targets()
+        with self._lock:
+            lags = [now - self.refreshed_at.get(url, self.started_at) for url in targets]
+            return {
+                "targets": len(lags),
+                "requests": self.requests,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.requests, 4) if self.requests else 0.0,
+                "refreshes": self.refreshes,
+                "failures": self.failures,
+                "budget_skips": self.budget_skips,
+                "tokens_last_hour": self._spent_last_hour(now),
+                "max_refresh_lag_seconds": round(max(lags), 1) if lags else 0.0,
+                "mean_refresh_lag_seconds": round(sum(lags) / len(lags), 1) if lags else 0.0,
+            }
+
+
+_warm_pool: Optional[WarmPool] = None
+_warm_pool_lock = threading.Lock()
+
+
+def get_warm_pool() -> Optional[WarmPool]:
+    return _warm_pool
+
+
+def start_warm_pool(urls: Iterable[str]) -> Optional[WarmPool]:
+    """Starts the process-wide warm pool the first time it is called; QUIZ_WARM_POOL=0 disables it."""
+    global _warm_pool
+    if os.getenv("QUIZ_WARM_POOL", "1") == "0":
+        return None
+
+    with _warm_pool_lock:
+        if _warm_pool is None:
+            _warm_pool = WarmPool(
+                urls,
+                refresh_seconds=float(os.getenv("QUIZ_WARM_POOL_REFRESH_SECONDS", 6 * 3600)),
+                concurrency=int(os.getenv("QUIZ_WARM_POOL_CONCURRENCY", 2)),
+                tokens_per_hour=int(os.getenv("QUIZ_WARM_POOL_TOKENS_PER_HOUR", 200_000)),
+                trending=int(os.getenv("QUIZ_WARM_POOL_TRENDING", 10)),
+            ).start()
+            metrics.register_collector("warm_pool", _warm_pool.stats)
+        return _warm_pool
+
+
+def get_warm_quiz(url: str) -> Optional[Dict[str, Any]]:
+    """The warm quiz of a URL (None if there is none), recording the request for the pool's statistics."""
+    warm_pool = get_warm_pool()
+    if warm_pool is None:
+        return None
+    quiz = warm_pool.get(url)
+    warm_pool.record_request(url, hit=quiz is not None)
+    return quiz
@@ -0,0 +1,205 @@
+"""
+Offline benchmark of quiz generation and LLM play against the local stand-ins in benchmarks/stand_ins.py.
+
+    python -m benchmarks.run --iterations 50 --concurrency 4 --latency-ms 200 -o benchmarks/results/after.json
+    python -m benchmarks.run --compare benchmarks/results/before.json benchmarks/results/after.json
+
+Every scenario runs in its own process and reports p50/p95/p99 latency, throughput, the number of upstream
+requests and the peak RSS of its process. Replies, pages and quizzes are seeded, so result files of two runs
+can be compared.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from .stand_ins import OpenAIStandIn, PagesStandIn, SerperStandIn, synthetic_quiz
+
+SCENARIOS = ["generate_quiz", "closed_book", "closed_book_batched", "web_rag"]
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(q / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def peak_rss_mb() -> float:
+    # the high-water mark of the whole process, hence one process per scenario;
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+def run_scenario(call: Callable[[int], Any], iterations: int, concurrency: int, servers: List[Any]) -> Dict[str, Any]:
+    requests_before = {type(server).__name__: server.requests for server in servers}
+
+    def timed(i: int) -> Optional[float]:
+        start = time.perf_counter()
+        try:
+            call(i)
+        except Exception as e:
+            print(f"  iteration {i} failed: {type(e).__name__}: {e}", file=sys.stderr)
+            return None
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(timed, range(iterations)))
+    wall = time.perf_counter() - start
+
+    # counted once the workers are done, so no counter is shared between them
+    latencies = sorted(latency for latency in outcomes if latency is not None)
+    return {
+        "iterations": iterations,
+        "errors": len(outcomes) - len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+        "throughput_per_s": round(len(latencies) / wall, 3) if wall else 0.0,
+        "upstream_requests": {
+            type(server).__name__: server.requests - requests_before[type(server).__name__] for server in servers
+        },
+        "scenario_peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    # a fresh interpreter per scenario (spawn, not fork), so the peak RSS of one is not that of the ones before
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for name in args.scenarios:
+        print(f"running {name}...", file=sys.stderr)
+        with context.Pool(1) as pool:
+            results[name] = pool.apply(run_isolated_scenario, (args, name))
+
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "commit": git_commit()},
+        "results": results,
+    }
+
+
+def run_isolated_scenario(args: argparse.Namespace, name: str) -> Dict[str, Any]:
+    """Runs one scenario against its own stand-ins and cache directory; called in a process of its own."""
+    random.seed(args.seed)
+
+    openai_server = OpenAIStandIn(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        seed=args.seed,
+        ms_per_token=args.ms_per_token,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+        invalid_question_rate=args.invalid_question_rate,
+    ).start()
+    serper_server = SerperStandIn(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, seed=args.seed).start()
+    pages_server = PagesStandIn(latency_ms=args.page_latency_ms, seed=args.seed).start()
+    servers = [openai_server, serper_server, pages_server]
+
+    # the backend reads its configuration when it is first used, so the environment is set before importing it
+    os.environ["OPENAI_BASE_URL"] = f"{openai_server.url}/v1"
+    os.environ["OPENAI_API_KEY"] = "benchmark"
+    os.environ["SERPERDEV_API_KEY"] = "benchmark"
+    os.environ["QUIZ_CACHE_DIR"] = tempfile.mkdtemp(prefix="quiz-benchmark-")
+
+    import haystack.components.websearch.serper_dev as serper_dev
+
+    serper_dev.SERPERDEV_BASE_URL = f"{serper_server.url}/search"
+
+    from backend import utils
+
+    quizzes = [synthetic_quiz(random.Random(args.seed + i)) for i in range(args.iterations)]
+
+    def page_url(i: int) -> str:
+        # without --warm every iteration asks for a different page, so nothing is served from a cache
+        return f"{pages_server.url}/article/{i % args.distinct_pages if args.warm else i}"
+
+    calls = {
+        "generate_quiz": lambda i: utils.generate_quiz(page_url(i)),
+        "closed_book": lambda i: utils.get_closed_book_answers(quizzes[i]),
+        "closed_book_batched": lambda i: utils.get_closed_book_answers(quizzes[i], mode="batched"),
+        "web_rag": lambda i: utils.get_web_rag_answers_and_snippets(quizzes[i]),
+    }
+
+    try:
+        return run_scenario(calls[name], args.iterations, args.concurrency, servers)
+    finally:
+        for server in servers:
+            server.stop()
+
+
+def compare(baseline_path: str, candidate_path: str) -> None:
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    with open(candidate_path, encoding="utf-8") as f:
+        candidate = json.load(f)["results"]
+
+    # result files from before scenarios ran in their own process have "peak_rss_mb", the running maximum
+    # of the whole benchmark, which is not comparable, so their RSS is left out
+    metrics = ["p50_ms", "p95_ms", "p99_ms", "throughput_per_s", "scenario_peak_rss_mb"]
+    print(f"{'scenario':22s} {'metric':20s} {'baseline':>12s} {'candidate':>12s} {'change':>9s}")
+    for name in sorted(set(baseline) & set(candidate)):
+        for metric in metrics:
+            if metric not in baseline[name] or metric not in candidate[name]:
+                continue
+            before, after = baseline[name][metric], candidate[name][metric]
+            change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+            print(f"{name:22s} {metric:20s} {before:12.2f} {after:12.2f} {change:>9s}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline benchmark of quiz generation and LLM play.")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="base latency of the OpenAI and Serper stand-ins")
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--ms-per-token", type=float, default=0.0, help="extra OpenAI latency per completion token")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of OpenAI requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After of the injected 429s, in seconds")
+    parser.add_argument(
+        "--invalid-question-rate", type=float, default=0.0, help="fraction of generated questions that are malformed"
+    )
+    parser.add_argument("--page-latency-ms", type=float, default=50.0)
+    parser.add_argument("--warm", action="store_true", help="reuse --distinct-pages pages so caches can hit")
+    parser.add_argument("--distinct-pages", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"), help="compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = run(args)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
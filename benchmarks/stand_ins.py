@@ -0,0 +1,365 @@
+"""
+Local stand-ins for the services the pipelines call: the OpenAI chat completions API, the SerperDev search API
+and the web pages quizzes are generated from.
+
+Replies are synthetic (or replayed from a recordings file) and deterministic for a given seed, and every server
+can add latency, so benchmarks run offline and without API costs:
+
+    python -m benchmarks.stand_ins --openai-port 8901 --serper-port 8902 --pages-port 8903 --latency-ms 300
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+
+class StandInServer:
+    """Runs a handler class on a local ThreadingHTTPServer in a background thread."""
+
+    handler_class = BaseHTTPRequestHandler
+
+    def __init__(self, port: int = 0, latency_ms: float = 0.0, jitter_ms: float = 0.0, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.seed = seed
+        self.requests = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(self.handler_class):
+            stand_in = server
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def start(self) -> "StandInServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "StandInServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def hit(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def random(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def delay(self, extra_ms: float = 0.0) -> None:
+        jitter = (self.random() * 2 - 1) * self.jitter_ms
+        seconds = max(self.latency_ms + jitter + extra_ms, 0.0) / 1000
+        if seconds:
+            time.sleep(seconds)
+
+
+def _send_json(handler: BaseHTTPRequestHandler, status: int, body: Any, headers: Optional[Dict[str, str]] = None):
+    payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+    handler.send_response(status)
+    handler.send_header("Content-Type", "application/json")
+    handler.send_header("Content-Length", str(len(payload)))
+    for key, value in (headers or {}).items():
+        handler.send_header(key, value)
+    handler.end_headers()
+    handler.wfile.write(payload)
+
+
+def _read_json(handler: BaseHTTPRequestHandler) -> Dict[str, Any]:
+    length = int(handler.headers.get("Content-Length", 0))
+    return json.loads(handler.rfile.read(length) or b"{}")
+
+
+def _seeded_rng(seed: int, text: str) -> random.Random:
+    # the same prompt always gets the same reply for a given seed, whatever the request order
+    digest = hashlib.sha256(f"{seed}:{text}".encode("utf-8")).hexdigest()
+    return random.Random(int(digest[:16], 16))
+
+
+def synthetic_quiz(rng: random.Random, questions: int = 5, invalid_rate: float = 0.0) -> Dict[str, Any]:
+    quiz_questions = []
+    for i in range(questions):
+        right_option = rng.choice("abcd")
+        question = {
+            "question": f"Pergunta sintética {i + 1} sobre o tópico {rng.randint(0, 10**6)}?",
+            "options": [f"{letter}. opção {letter} {rng.randint(0, 999)}" for letter in "abcd"],
+            "right_option": right_option,
+            "explanation": f"A opção '{right_option}' está correta segundo o texto.",
+        }
+        if invalid_rate and rng.random() < invalid_rate:
+            # the kind of mistake a model makes: a missing option and an answer that doesn't exist
+            question["options"] = question["options"][:3]
+            question["right_option"] = "e"
+        quiz_questions.append(question)
+    return {"topic": "Um tópico sintético usado nos benchmarks", "questions": quiz_questions}
+
+
+class OpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    stand_in: "OpenAIStandIn"
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            _send_json(self, 404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+
+        request = _read_json(self)
+        stand_in = self.stand_in
+        stand_in.hit()
+
+        if stand_in.error_rate and stand_in.random() < stand_in.error_rate:
+            _send_json(
+                self,
+                429,
+                {"error": {"message": "Rate limit reached (stand-in)", "type": "requests", "code": "rate_limit_exceeded"}},
+                headers={"Retry-After": str(stand_in.retry_after)},
+            )
+            return
+
+        prompt = "\n".join(str(message.get("content", "")) for message in request.get("messages", []))
+        reply = stand_in.reply_for(prompt, request)
+        completion_tokens = max(len(reply) // 4, 1)
+        prompt_tokens = max(len(prompt) // 4, 1)
+        # a streamed reply pays the per-token latency while the chunks are sent
+        stand_in.delay(0.0 if request.get("stream") else stand_in.ms_per_token * completion_tokens)
+
+        created = int(time.time())
+        model = request.get("model", "gpt-4o-mini")
+
+        if not request.get("stream"):
+            _send_json(
+                self,
+                200,
+                {
+                    "id": "chatcmpl-stand-in",
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": reply},
+                            "finish_reason": "stop",
+                            "logprobs": None,
+                        }
+                    ],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens,
+                    },
+                },
+            )
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        pieces = [reply[i : i + 16] for i in range(0, len(reply), 16)] + [None]
+        for piece in pieces:
+            chunk = {
+                "id": "chatcmpl-stand-in",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"content": piece} if piece is not None else {},
+                        "finish_reason": None if piece is not None else "stop",
+                        "logprobs": None,
+                    }
+                ],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            chunk_ms = stand_in.stream_chunk_ms + stand_in.ms_per_token * len(piece or "") / 4
+            if chunk_ms:
+                time.sleep(chunk_ms / 1000)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+class OpenAIStandIn(StandInServer):
+    """
+    An OpenAI-compatible /v1/chat/completions endpoint.
+
+    Replies come from `recordings` (a list of {"match": substring, "reply": text}) when a prompt matches,
+    and are otherwise synthesized from the prompt: a quiz for generation prompts, an answer vector for batched
+    closed-book prompts and a single letter for the other answering prompts.
+    """
+
+    handler_class = OpenAIHandler
+
+    def __init__(
+        self,
+        port: int = 0,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        seed: int = 0,
+        ms_per_token: float = 0.0,
+        stream_chunk_ms: float = 0.0,
+        error_rate: float = 0.0,
+        retry_after: float = 1.0,
+        invalid_question_rate: float = 0.0,
+        recordings: Optional[List[Dict[str, str]]] = None,
+    ):
+        super().__init__(port, latency_ms, jitter_ms, seed)
+        self.ms_per_token = ms_per_token
+        self.stream_chunk_ms = stream_chunk_ms
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.invalid_question_rate = invalid_question_rate
+        self.recordings = recordings or []
+
+    def reply_for(self, prompt: str, request: Dict[str, Any]) -> str:
+        for recording in self.recordings:
+            if recording["match"] in prompt:
+                return recording["reply"]
+
+        rng = _seeded_rng(self.seed, prompt)
+        if '"questions"' in prompt:
+            return json.dumps(synthetic_quiz(rng, invalid_rate=self.invalid_question_rate), ensure_ascii=False)
+        if "lista JSON" in prompt:
+            count = len(re.findall(r"^pergunta \d+:", prompt, re.M)) or 5
+            return json.dumps([rng.choice("abcd") for _ in range(count)])
+        return rng.choice("abcd")
+
+
+class SerperHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    stand_in: "SerperStandIn"
+
+    def do_POST(self):
+        request = _read_json(self)
+        query = request.get("q", "")
+        self.stand_in.hit()
+        self.stand_in.delay()
+
+        rng = _seeded_rng(self.stand_in.seed, query)
+        organic = [
+            {
+                "title": f"Resultado {i + 1} para {query[:40]}",
+                "link": f"https://example.org/{rng.randint(0, 10**6)}",
+                "snippet": f"Trecho {i + 1} sobre {query[:60]} ({rng.randint(0, 10**6)}).",
+                "position": i + 1,
+            }
+            for i in range(request.get("num", 10))
+        ]
+        _send_json(self, 200, {"searchParameters": request, "organic": organic})
+
+
+class SerperStandIn(StandInServer):
+    """A stand-in for https://google.serper.dev/search returning seeded organic results."""
+
+    handler_class = SerperHandler
+
+
+class PagesHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    stand_in: "PagesStandIn"
+
+    def do_GET(self):
+        self.stand_in.hit()
+        body = self.stand_in.page(self.path).encode("utf-8")
+        etag = '"%s"' % hashlib.sha256(body).hexdigest()[:16]
+        self.stand_in.delay()
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class PagesStandIn(StandInServer):
+    """Serves a deterministic article for every path, so generate_quiz can fetch pages offline."""
+
+    handler_class = PagesHandler
+
+    def __init__(self, port: int = 0, latency_ms: float = 0.0, jitter_ms: float = 0.0, seed: int = 0, paragraphs: int = 40):
+        super().__init__(port, latency_ms, jitter_ms, seed)
+        self.paragraphs = paragraphs
+
+    def page(self, path: str) -> str:
+        rng = _seeded_rng(self.seed, path)
+        words = ["floresta", "animal", "espécie", "história", "filme", "música", "cidade", "ciência", "água", "tempo"]
+        paragraphs = "\n".join(
+            "<p>" + " ".join(rng.choice(words) for _ in range(60)) + ".</p>" for _ in range(self.paragraphs)
+        )
+        return (
+            f"<html><head><title>Artigo {path}</title></head><body>"
+            f"<nav><a href='/'>Início</a></nav><article><h1>Artigo {path}</h1>{paragraphs}</article></body></html>"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the OpenAI, SerperDev and web page stand-ins.")
+    parser.add_argument("--openai-port", type=int, default=8901)
+    parser.add_argument("--serper-port", type=int, default=8902)
+    parser.add_argument("--pages-port", type=int, default=8903)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--ms-per-token", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of OpenAI requests answered with 429")
+    parser.add_argument("--recordings", help="JSON file with a list of {match, reply} objects")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    recordings = None
+    if args.recordings:
+        with open(args.recordings, encoding="utf-8") as f:
+            recordings = json.load(f)
+
+    servers = [
+        OpenAIStandIn(
+            args.openai_port, args.latency_ms, args.jitter_ms, args.seed, args.ms_per_token,
+            error_rate=args.error_rate, recordings=recordings,
+        ),
+        SerperStandIn(args.serper_port, args.latency_ms, args.jitter_ms, args.seed),
+        PagesStandIn(args.pages_port, args.latency_ms, args.jitter_ms, args.seed),
+    ]
+    for server in servers:
+        server.start()
+        print(f"{type(server).__name__} listening on {server.url}")
+    print(f"export OPENAI_BASE_URL={servers[0].url}/v1")
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        for server in servers:
+            server.stop()
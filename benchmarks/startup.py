@@ -0,0 +1,60 @@
+"""
+Measures the cold import time of the backend and the time to build each pipeline on first use.
+
+Every measurement runs in a fresh interpreter, so nothing is shared between samples:
+
+    python benchmarks/startup.py --repeat 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, time
+start = time.perf_counter()
+import backend.utils as utils
+timings = {"import backend.utils": time.perf_counter() - start}
+for name in %r:
+    start = time.perf_counter()
+    getattr(utils, name)()
+    timings[name] = time.perf_counter() - start
+print(json.dumps(timings))
+"""
+
+FACTORIES = [
+    "get_document_fetch_pipeline",
+    "get_quiz_generation_pipeline",
+    "get_closed_book_answer_pipeline",
+    "get_web_rag_pipeline",
+]
+
+
+def measure(repeat: int):
+    env = {
+        "OPENAI_API_KEY": "startup-benchmark",
+        "SERPERDEV_API_KEY": "startup-benchmark",
+        **os.environ,
+    }
+    samples = {}
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, "-c", PROBE % (FACTORIES,)], cwd=ROOT, env=env
+        )
+        for name, seconds in json.loads(output.decode().strip().splitlines()[-1]).items():
+            samples.setdefault(name, []).append(seconds)
+    return {name: statistics.median(values) for name, values in samples.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for name, seconds in measure(args.repeat).items():
+        print(f"{name:40s} {seconds * 1000:8.1f} ms")
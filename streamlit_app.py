@@ -1,12 +1,20 @@
 import streamlit as st
+import json
 import random
 import os
 # Reativando a importação do web_rag
 from backend.utils import (
-    generate_quiz,
+    generate_quiz_streaming,
     get_closed_book_answers,
     get_web_rag_answers_and_snippets,
+    get_local_rag_answers_and_snippets,
+    get_attempt_store,
 )
+from backend.metrics import metrics
+from backend.quiz import OPTION_LETTERS, Quiz, encode_answer
+from backend.scoring import question_stats, score_attempts
+from backend.warm_pool import start_warm_pool
+import numpy as np
 
 # Configuração da página
 st.set_page_config(
@@ -67,13 +75,18 @@ URL_EXAMPLES = [
     "https://www.rainforest-alliance.org/species/sloth/",
 ]
 
+# Pré-gera os quizzes dos exemplos (e das URLs mais pedidas) em segundo plano, uma vez por processo
+start_warm_pool(URL_EXAMPLES)
+
 # Inicialização do estado da sessão
 if 'quiz' not in st.session_state:
     st.session_state.quiz = None
 if 'quiz_generated' not in st.session_state:
     st.session_state.quiz_generated = False
+if 'quiz_model' not in st.session_state:
+    st.session_state.quiz_model = None
 if 'user_answers' not in st.session_state:
-    st.session_state.user_answers = [None] * 5
+    st.session_state.user_answers = []
 if 'quiz_submitted' not in st.session_state:
     st.session_state.quiz_submitted = False
 if 'show_llm_results' not in st.session_state:
@@ -118,33 +131,79 @@ with col2:
 # Geração do quiz
 if generate_btn and url:
     with st.spinner("🔄 Gerando questionário..."):
+        # as perguntas são exibidas à medida que são geradas
+        preview = st.empty()
+        preview_container = preview.container()
+
+        def show_question(i, question):
+            preview_container.write(f"**Pergunta {i+1}:** {question.get('question', '')}")
+            for option in question.get("options", []):
+                preview_container.write(f"- {option}")
+
         try:
-            quiz = generate_quiz(url)
+            quiz = generate_quiz_streaming(url, show_question)
+            preview.empty()
             st.session_state.quiz = quiz
+            st.session_state.quiz_model = Quiz.from_dict(quiz)
             st.session_state.quiz_generated = True
             st.session_state.quiz_submitted = False
-            st.session_state.user_answers = [None] * 5
+            st.session_state.user_answers = [None] * len(quiz["questions"])
             st.session_state.show_llm_results = False
             st.success("✅ Questionário gerado com sucesso!")
         except Exception as e:
             st.error(f"❌ Erro ao gerar questionário: {str(e)}")
             st.info("Verifique se a URL é válida e se as variáveis de ambiente estão configuradas.")
 
+def record_attempt(player, answers):
+    # todas as tentativas (usuário e LLM) são guardadas para as estatísticas das perguntas
+    try:
+        get_attempt_store().add(st.session_state.quiz_model, player, answers)
+    except Exception as e:
+        st.warning(f"⚠️ Não foi possível guardar a tentativa: {str(e)}")
+
+
+def show_llm_results(mode_name, player, answers, snippets=None, snippets_title=None):
+    quiz_model = st.session_state.quiz_model
+    encoded = quiz_model.encode_answers(answers)
+    result = score_attempts(quiz_model.answer_key, encoded)
+    correct = result["correct"][0]
+    score = int(result["scores"][0])
+    record_attempt(player, encoded)
+
+    details = []
+    for i, question in enumerate(quiz_model.questions):
+        details.append(f"**Pergunta**: {question.text}\n\n")
+        details.append(f"**Resposta da LLM**: {question.option(encoded[i]) or 'Resposta inválida'}\n\n")
+        details.append(f"**Resposta correta**: {question.right_answer}\n\n")
+        details.append("✅ **Resultado**: Correto\n\n" if correct[i] else "❌ **Resultado**: Errado\n\n")
+        if snippets is not None:
+            details.append(f"**{snippets_title}**:\n\n")
+            details.extend(f"- {snippet}\n" for snippet in snippets[i])
+            details.append("\n")
+        details.append("---\n\n")
+
+    st.success(
+        f"🎯 Pontuação da LLM ({mode_name}): {result['fractions'][0] * 100:.0f}% ({score}/{len(quiz_model)})"
+    )
+    with st.expander("📋 Detalhes das Respostas"):
+        st.markdown("".join(details))
+
+
 # Exibição do quiz
 if st.session_state.quiz_generated and st.session_state.quiz:
-    quiz = st.session_state.quiz
+    quiz_model = st.session_state.quiz_model
     
     st.markdown('<div class="quiz-container">', unsafe_allow_html=True)
     st.subheader("📋 Questionário")
     
     # Perguntas do quiz
-    for i, question in enumerate(quiz["questions"]):
-        st.write(f"**Pergunta {i+1}:** {question['question']}")
+    for i, question in enumerate(quiz_model.questions):
+        st.write(f"**Pergunta {i+1}:** {question.text}")
         
         if not st.session_state.quiz_submitted:
             answer = st.radio(
                 "Escolha sua resposta:",
-                options=question["options"],
+                options=question.options,
                 key=f"question_{i}",
                 index=None
             )
@@ -153,25 +212,33 @@ if st.session_state.quiz_generated and st.session_state.quiz:
         else:
             # Mostrar respostas após submissão
             user_answer = st.session_state.user_answers[i]
-            correct_answer = question["options"][ord(question["right_option"]) - ord('a')]
             
             if user_answer:
-                if user_answer[0] == question["right_option"]:
+                if encode_answer(user_answer) == question.right_index:
                     st.markdown(f'<p class="result-correct">✅ Sua resposta: {user_answer} - Correto!</p>', unsafe_allow_html=True)
                 else:
                     st.markdown(f'<p class="result-wrong">❌ Sua resposta: {user_answer} - Errado</p>', unsafe_allow_html=True)
-                    st.markdown(f'<p>✅ Resposta correta: {correct_answer}</p>', unsafe_allow_html=True)
+                    st.markdown(f'<p>✅ Resposta correta: {question.right_answer}</p>', unsafe_allow_html=True)
                     # Adicionando a explicação
-                    if "explanation" in question and question["explanation"]:
-                        st.info(f"**Explicação:** {question['explanation']}")
+                    if question.explanation:
+                        st.info(f"**Explicação:** {question.explanation}")
             else:
                 st.markdown(f'<p class="result-wrong">❌ Não respondida</p>', unsafe_allow_html=True)
-                st.markdown(f'<p>✅ Resposta correta: {correct_answer}</p>', unsafe_allow_html=True)
+                st.markdown(f'<p>✅ Resposta correta: {question.right_answer}</p>', unsafe_allow_html=True)
                 # Adicionando a explicação também para questões não respondidas
-                if "explanation" in question and question["explanation"]:
-                    st.info(f"**Explicação:** {question['explanation']}")
+                if question.explanation:
+                    st.info(f"**Explicação:** {question.explanation}")
         
         st.write("---")
+
+    if st.session_state.quiz_submitted:
+        user_result = score_attempts(
+            quiz_model.answer_key, quiz_model.encode_answers(st.session_state.user_answers)
+        )
+        st.success(
+            f"🎯 Sua pontuação: {user_result['fractions'][0] * 100:.0f}% "
+            f"({int(user_result['scores'][0])}/{len(quiz_model)})"
+        )
     
     # Botões de ação
     col1, col2, col3 = st.columns(3)
@@ -180,15 +247,7 @@ if st.session_state.quiz_generated and st.session_state.quiz:
         if not st.session_state.quiz_submitted:
             if st.button("📤 Enviar Respostas", type="primary"):
                 st.session_state.quiz_submitted = True
-                
-                # Calcular pontuação
-                score = 0
-                for i, answer in enumerate(st.session_state.user_answers):
-                    if answer and answer[0] == quiz["questions"][i]["right_option"]:
-                        score += 1
-                
-                score_percentage = (score / 5) * 100
-                st.success(f"🎯 Sua pontuação: {score_percentage:.0f}% ({score}/5)")
+                record_attempt("user", quiz_model.encode_answers(st.session_state.user_answers))
                 st.rerun()
     
     with col2:
@@ -199,9 +258,10 @@ if st.session_state.quiz_generated and st.session_state.quiz:
     with col3:
         if st.button("🔄 Novo Quiz"):
             st.session_state.quiz = None
+            st.session_state.quiz_model = None
             st.session_state.quiz_generated = False
             st.session_state.quiz_submitted = False
-            st.session_state.user_answers = [None] * 5
+            st.session_state.user_answers = []
             st.session_state.show_llm_results = False
             st.rerun()
     
@@ -221,33 +281,7 @@ if st.session_state.show_llm_results and st.session_state.quiz:
         with st.spinner("🤖 LLM respondendo sem consulta..."):
             try:
                 answers = get_closed_book_answers(quiz)
-                
-                score = 0
-                details = ""
-                
-                for i, answer in enumerate(answers):
-                    question = quiz['questions'][i]
-                    llm_answer = question['options'][ord(answer) - ord('a')] if answer in 'abcd' else "Resposta inválida"
-                    correct_answer = question['options'][ord(question['right_option']) - ord('a')]
-                    
-                    details += f"**Pergunta**: {question['question']}\n\n"
-                    details += f"**Resposta da LLM**: {llm_answer}\n\n"
-                    details += f"**Resposta correta**: {correct_answer}\n\n"
-                    
-                    if answer == question['right_option']:
-                        score += 1
-                        details += "✅ **Resultado**: Correto\n\n"
-                    else:
-                        details += "❌ **Resultado**: Errado\n\n"
-                    
-                    details += "---\n\n"
-                
-                score_percentage = (score / 5) * 100
-                st.success(f"🎯 Pontuação da LLM (Exame sem Consulta): {score_percentage:.0f}% ({score}/5)")
-                
-                with st.expander("📋 Detalhes das Respostas"):
-                    st.markdown(details)
-                    
+                show_llm_results("Exame sem Consulta", "closed_book", answers)
             except Exception as e:
                 st.error(f"❌ Erro no exame sem consulta: {str(e)}")
     
@@ -262,39 +296,55 @@ if st.session_state.show_llm_results and st.session_state.quiz:
             with st.spinner("🌐 LLM respondendo com RAG Web..."):
                 try:
                     answers, snippets = get_web_rag_answers_and_snippets(quiz)
-                    
-                    score = 0
-                    details = ""
-                    
-                    for i, answer in enumerate(answers):
-                        question = quiz['questions'][i]
-                        llm_answer = question['options'][ord(answer) - ord('a')] if answer in 'abcd' else "Resposta inválida"
-                        correct_answer = question['options'][ord(question['right_option']) - ord('a')]
-                        
-                        details += f"**Pergunta**: {question['question']}\n\n"
-                        details += f"**Resposta da LLM**: {llm_answer}\n\n"
-                        details += f"**Resposta correta**: {correct_answer}\n\n"
-                        
-                        if answer == question['right_option']:
-                            score += 1
-                            details += "✅ **Resultado**: Correto\n\n"
-                        else:
-                            details += "❌ **Resultado**: Errado\n\n"
-                        
-                        details += "**Top 3 trechos da pesquisa Google**:\n\n"
-                        for snippet in snippets[i]:
-                            details += f"- {snippet}\n"
-                        details += "\n---\n\n"
-                    
-                    score_percentage = (score / 5) * 100
-                    st.success(f"🎯 Pontuação da LLM (RAG Web): {score_percentage:.0f}% ({score}/5)")
-                    
-                    with st.expander("📋 Detalhes das Respostas"):
-                        st.markdown(details)
-                        
+                    show_llm_results("RAG Web", "web_rag", answers, snippets, "Top 3 trechos da pesquisa Google")
                 except Exception as e:
                     st.error(f"❌ Erro no RAG Web: {str(e)}")
 
+    # Modo RAG Local
+    st.subheader("📄 RAG Local")
+    st.write("Os 3 trechos mais relevantes da própria página de origem são incluídos no prompt, sem pesquisa na web.")
+
+    if st.button("🎯 Tentar RAG Local"):
+        with st.spinner("📄 LLM respondendo com RAG Local..."):
+            try:
+                answers, snippets = get_local_rag_answers_and_snippets(quiz)
+                show_llm_results("RAG Local", "local_rag", answers, snippets, "Top 3 trechos da página de origem")
+            except Exception as e:
+                st.error(f"❌ Erro no RAG Local: {str(e)}")
+
+# Estatísticas das perguntas, sobre todas as tentativas deste quiz (usuários e LLM)
+if st.session_state.quiz_generated and st.session_state.quiz_model:
+    with st.expander("📈 Estatísticas das Perguntas"):
+        try:
+            answer_key, players, attempts = get_attempt_store().load(st.session_state.quiz_model.key)
+        except KeyError:
+            attempts = None
+        if attempts is None or not len(attempts):
+            st.write("Nenhuma tentativa registrada ainda.")
+        else:
+            stats = question_stats(answer_key, attempts)
+            st.write(f"**{stats['attempts']} tentativas**")
+            st.dataframe(
+                [
+                    {
+                        "pergunta": i + 1,
+                        "acertos": f"{stats['difficulty'][i] * 100:.0f}%",
+                        # indefinida enquanto todas as tentativas acertam (ou erram) a pergunta
+                        "discriminação": (
+                            None
+                            if np.isnan(stats["discrimination"][i])
+                            else round(float(stats["discrimination"][i]), 2)
+                        ),
+                        **{
+                            f"opção {letter}": int(stats["option_counts"][i][j])
+                            for j, letter in enumerate(OPTION_LETTERS)
+                        },
+                    }
+                    for i in range(len(answer_key))
+                ],
+                hide_index=True,
+            )
+
 # Informações sobre o projeto
 with st.expander("ℹ️ Sobre o Quiz"):
     st.markdown("""
@@ -305,9 +355,10 @@ with st.expander("ℹ️ Sobre o Quiz"):
     **Funcionalidades:**
     - 📝 Geração automática de questionários a partir de URLs
     - 🎮 Modo de jogo para usuários
-    - 🤖 Modo LLM com duas variantes:
+    - 🤖 Modo LLM com três variantes:
         - 📕 **Exame sem Consulta**: LLM responde baseado apenas em conhecimento interno
         - 🔎 **RAG Web**: LLM responde com auxílio de pesquisa no Google
+        - 📄 **RAG Local**: LLM responde com trechos da própria página de origem
     
     **Tecnologias:**
     - 🏗️ **Haystack**: Framework para aplicações de LLM
@@ -319,3 +370,62 @@ with st.expander("ℹ️ Sobre o Quiz"):
     - Configure `OPENAI_API_KEY` para usar o GPT-4o-mini
     - Configure `SERPERDEV_API_KEY` para usar o modo RAG Web (opcional)
     """)
+
+# Painel de métricas (no final do script, para incluir as chamadas desta execução)
+with st.sidebar:
+    with st.expander("📊 Métricas"):
+        snapshot = metrics.snapshot()
+
+        warm_pool_stats = snapshot["collectors"].get("warm_pool")
+        if warm_pool_stats:
+            st.write("**Pré-geração (warm pool)**")
+            hit_rate_col, lag_col = st.columns(2)
+            hit_rate_col.metric("Acertos", f"{warm_pool_stats['hit_rate'] * 100:.0f}%")
+            lag_col.metric("Atraso máx.", f"{warm_pool_stats['max_refresh_lag_seconds'] / 60:.0f} min")
+
+        component_rows = [
+            {
+                "pipeline": entry["labels"]["pipeline"],
+                "componente": entry["labels"]["component"],
+                "chamadas": entry["count"],
+                "p50 (ms)": round(entry.get("p50", 0) * 1000, 1),
+                "p95 (ms)": round(entry.get("p95", 0) * 1000, 1),
+            }
+            for entry in snapshot["histograms"].get("component_seconds", [])
+        ]
+        if component_rows:
+            st.write("**Tempo por componente**")
+            st.dataframe(component_rows, hide_index=True)
+        else:
+            st.write("Nenhuma chamada registrada ainda.")
+
+        token_rows = [
+            {
+                "pipeline": entry["labels"]["pipeline"],
+                "tokens": name,
+                "total": int(entry["sum"]),
+                "p50": entry.get("p50", 0),
+            }
+            for name in ("prompt_tokens", "completion_tokens")
+            for entry in snapshot["histograms"].get(name, [])
+        ]
+        if token_rows:
+            st.write("**Tokens**")
+            st.dataframe(token_rows, hide_index=True)
+
+        for name, values in snapshot["collectors"].items():
+            st.write(f"**{name}**")
+            st.json(values, expanded=False)
+
+        st.download_button(
+            "⬇️ JSON",
+            data=json.dumps(snapshot, indent=2),
+            file_name="quiz_metrics.json",
+            mime="application/json",
+        )
+        st.download_button(
+            "⬇️ Prometheus",
+            data=metrics.to_prometheus(),
+            file_name="quiz_metrics.prom",
+            mime="text/plain",
+        )